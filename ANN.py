@@ -12,19 +12,54 @@
 
 # numpy for various mathematical operations (e.g. multiplication of matrices)
 import numpy
-# scipy.special for the sigmoid function expit()
-import scipy.special
-# access to main.py needed for global constants
-import main
+# global constants (see config.py)
+import config
+
+# sigmoid function, set on first use (see activation_function)
+_expit = None
+
+# workspaces for training_step_in_place, one per shape of network and
+# number of records in a batch (see training_workspace)
+_workspaces = {}
+
+
+# numpy version of the sigmoid function, used if scipy is not installed
+# (agrees with scipy.special.expit to within one unit in the last place)
+def numpy_expit(x, out=None):
+
+    outputs = numpy.negative(x, out=out)
+    # exp overflows to infinity for large negative x, giving 0 as it should
+    with numpy.errstate(over='ignore'):
+        numpy.exp(outputs, out=outputs)
+    outputs += 1.0
+    numpy.reciprocal(outputs, out=outputs)
+
+    return outputs
+
+
+# activation function is the sigmoid function: scipy.special.expit, imported
+# on first use rather than with this module (scipy takes longer to import
+# than everything else used by training and answering queries put together)
+# - out = array to write the outputs to (may be x itself)
+def activation_function(x, out=None):
+    global _expit
+
+    if _expit is None:
+        try:
+            import scipy.special
+            _expit = scipy.special.expit
+        except ImportError:
+            _expit = numpy_expit
+
+    return _expit(x, out=out)
 
-# activation function is the sigmoid function
-activation_function = lambda x: scipy.special.expit(x)
 
 # forward_prop is the "forward propagation" part of
 # the overall "back propagation" algorithm
 def forward_prop(inputs, wih, who):
     #
-    #  inputs = inputs to ANN
+    #  inputs = inputs to ANN (one column per record, so a batch of
+    #           records is propagated with matrix-matrix products)
     #  wih = weights used between input and hidden layers
     #  who = weights used between hidden and output
     #
@@ -49,13 +84,67 @@ def forward_prop(inputs, wih, who):
     return hidden_layer_outputs, output_layer_outputs
 
 
+# forward_prop_stacked runs forward propagation for several networks of the same
+# shape at once (e.g. the weights for all scenarios), using one batched
+# matrix multiplication per layer instead of one call to forward_prop per network
+def forward_prop_stacked(inputs, wih_stack, who_stack):
+    #
+    #  inputs = inputs to ANN, shared by every network
+    #  wih_stack = weights used between input and hidden layers,
+    #              one matrix per network stacked along the first axis
+    #  who_stack = weights used between hidden and output layers,
+    #              one matrix per network stacked along the first axis
+    #
+    # inputs are broadcast across the stack, so for a (784, 1) input and
+    # (4, 200, 784) weights the hidden layer outputs are (4, 200, 1)
+    hidden_layer_outputs = activation_function(numpy.matmul(wih_stack, inputs))
+
+    # output layer outputs are (4, 10, 1) - one column per network
+    output_layer_outputs = activation_function(
+        numpy.matmul(who_stack, hidden_layer_outputs))
+
+    return hidden_layer_outputs, output_layer_outputs
+
+
+# inference_weights prepares stacked weights (see forward_prop_stacked) for
+# answering queries in a reduced precision:
+#   "float64" - weights as trained
+#   "float32" - half the size, and about twice as fast per query
+def inference_weights(wih_stack, who_stack, precision):
+
+    if precision == "float64":
+        dtype = numpy.float64
+    elif precision == "float32":
+        dtype = numpy.float32
+    else:
+        raise ValueError("unknown inference precision: " + str(precision))
+
+    return {
+        "precision": precision,
+        "wih": numpy.asarray(wih_stack, dtype=dtype),
+        "who": numpy.asarray(who_stack, dtype=dtype)
+    }
+
+
+# forward_prop_inference is forward_prop_stacked using weights prepared by
+# inference_weights (in float64 or float32 precision)
+def forward_prop_inference(inputs, weights):
+    #
+    #  inputs = inputs to ANN, shared by every network
+    #  weights = weights for each network, from inference_weights
+    #
+    inputs = numpy.asarray(inputs, dtype=weights["wih"].dtype)
+
+    return forward_prop_stacked(inputs, weights["wih"], weights["who"])
+
+
 # backward_prop is the "backward propagation"
 # (including error calculation and gradient descent) part of
 # the overall "back propagation" algorithm
 def backward_prop(inputs, hidden_layer_outputs, output_layer_outputs, targets,
                   wih, who):
     #
-    #  inputs = inputs to ANN
+    #  inputs = inputs to ANN (one column per record in the batch)
     #  hidden_layer_outputs =
     #         outputs from hidden layer generated during forward propagation
     #  output_layer_outputs =
@@ -65,6 +154,11 @@ def backward_prop(inputs, hidden_layer_outputs, output_layer_outputs, targets,
     #  who = weights used between hidden and output layers
     #
 
+    # for a batch of records the gradients of all records are summed by the
+    # matrix products below, so the step is divided by the batch size to
+    # apply the averaged gradient (a batch of 1 gives the per-record step)
+    learning_rate = config.configuration["learning_rate"] / inputs.shape[1]
+
     ####### calculate errors
     # output layer errors are calculated by taking differences between
     # the expected (as derived from label) values & the predicted (by ANN) values
@@ -76,12 +170,103 @@ def backward_prop(inputs, hidden_layer_outputs, output_layer_outputs, targets,
 
     ####### update weights (backward propagation using gradient descent)
     # update the weights for the links between the input and hidden layers
-    wih += main.configuration["learning_rate"] * numpy.dot(
+    wih += learning_rate * numpy.dot(
         (hidden_errors * hidden_layer_outputs *
          (1.0 - hidden_layer_outputs)), numpy.transpose(inputs))
     # update the weights for the links between the hidden and output layers
-    who += main.configuration["learning_rate"] * numpy.dot(
+    who += learning_rate * numpy.dot(
         (output_errors * output_layer_outputs *
          (1.0 - output_layer_outputs)), numpy.transpose(hidden_layer_outputs))
 
-    return wih, who
\ No newline at end of file
+    return wih, who
+
+
+# training_workspace gives the arrays used by training_step_in_place for a
+# network with weights wih and who and a batch of num_records records -
+# allocated on first use for each shape and reused for every step after that
+def training_workspace(wih, who, num_records):
+
+    key = (wih.shape, who.shape, num_records)
+    workspace = _workspaces.get(key)
+
+    if workspace is None:
+        hidden_nodes, input_nodes = wih.shape
+        output_nodes = who.shape[0]
+        workspace = {
+            # inputs to ANN, one row per record (used transposed, one column
+            # per record, as for forward_prop), and expected outputs
+            "input_rows": numpy.empty((num_records, input_nodes)),
+            "targets": numpy.empty((output_nodes, num_records)),
+            "records": numpy.arange(num_records),
+            # forward propagation
+            "hidden_outputs": numpy.empty((hidden_nodes, num_records)),
+            "output_outputs": numpy.empty((output_nodes, num_records)),
+            # backward propagation
+            "output_errors": numpy.empty((output_nodes, num_records)),
+            "output_gradients": numpy.empty((output_nodes, num_records)),
+            "hidden_errors": numpy.empty((hidden_nodes, num_records)),
+            "hidden_gradients": numpy.empty((hidden_nodes, num_records)),
+            "who_update": numpy.empty(who.shape),
+            "wih_update": numpy.empty(wih.shape)
+        }
+        _workspaces[key] = workspace
+
+    return workspace
+
+
+# training_step_in_place is forward_prop followed by backward_prop for the
+# inputs and targets held in the workspace (see training_workspace), writing
+# every intermediate result into the workspace instead of new arrays - the
+# operations (and so the updated weights) are exactly those of forward_prop
+# and backward_prop
+def training_step_in_place(workspace, wih, who):
+    #
+    #  workspace = from training_workspace, with "input_rows" and "targets"
+    #              filled in for the records in the batch
+    #  wih = weights used between input and hidden layers (updated in place)
+    #  who = weights used between hidden and output layers (updated in place)
+    #
+    inputs = workspace["input_rows"].T
+    targets = workspace["targets"]
+    hidden_layer_outputs = workspace["hidden_outputs"]
+    output_layer_outputs = workspace["output_outputs"]
+    output_errors = workspace["output_errors"]
+    output_gradients = workspace["output_gradients"]
+    hidden_errors = workspace["hidden_errors"]
+    hidden_gradients = workspace["hidden_gradients"]
+
+    learning_rate = config.configuration["learning_rate"] / inputs.shape[1]
+
+    ######  feed forward (as forward_prop)
+    numpy.dot(wih, inputs, out=hidden_layer_outputs)
+    activation_function(hidden_layer_outputs, out=hidden_layer_outputs)
+    numpy.dot(who, hidden_layer_outputs, out=output_layer_outputs)
+    activation_function(output_layer_outputs, out=output_layer_outputs)
+
+    ####### calculate errors (as backward_prop)
+    numpy.subtract(targets, output_layer_outputs, out=output_errors)
+    numpy.dot(who.T, output_errors, out=hidden_errors)
+
+    ####### update weights (as backward_prop)
+    # hidden_errors * hidden_layer_outputs * (1.0 - hidden_layer_outputs),
+    # multiplied left to right as in backward_prop
+    numpy.multiply(hidden_errors, hidden_layer_outputs, out=hidden_gradients)
+    numpy.subtract(1.0, hidden_layer_outputs, out=hidden_errors)
+    hidden_gradients *= hidden_errors
+    # the same for the output layer
+    numpy.multiply(output_errors, output_layer_outputs, out=output_gradients)
+    numpy.subtract(1.0, output_layer_outputs, out=output_errors)
+    output_gradients *= output_errors
+
+    # (hidden_errors were worked out from who before it is updated below,
+    # as in backward_prop)
+    wih_update = numpy.dot(hidden_gradients, inputs.T,
+                           out=workspace["wih_update"])
+    wih_update *= learning_rate
+    wih += wih_update
+    who_update = numpy.dot(output_gradients, hidden_layer_outputs.T,
+                           out=workspace["who_update"])
+    who_update *= learning_rate
+    who += who_update
+
+    return wih, who
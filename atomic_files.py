@@ -0,0 +1,47 @@
+###################################################################################
+#
+#   Writing files atomically
+#
+#   A file is written to a temporary file next to it, flushed to disk and then
+#   renamed into place, so a reader (e.g. the realtime application, or a later
+#   run after a crash part way through writing) sees either the old file or the
+#   complete new one, never a half-written one. Existing memory maps of the old
+#   file keep the old contents
+#
+#   The temporary file has a unique name, so processes writing the same file at
+#   once never write to the same temporary file
+#
+#   called from:
+#         checkpoints.py
+#         mnist_data.py
+#         model_files.py
+#         train_and_test.py
+#         sweep.py
+#
+###################################################################################
+
+# os and tempfile for the temporary file, flushing it to disk and renaming it
+import os
+import tempfile
+
+
+# write a file atomically: write(f) writes the contents to a temporary file
+# (opened with mode, e.g. 'w' for text), which is flushed to disk and then
+# renamed into place - the temporary file is removed if anything fails
+def write_atomically(file_name, write, mode='wb'):
+
+    fd, temp_file = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(file_name)),
+        prefix=os.path.basename(file_name) + ".",
+        suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # (mkstemp makes files readable by their owner only)
+        os.chmod(temp_file, 0o644)
+        os.replace(temp_file, file_name)
+    except BaseException:
+        os.remove(temp_file)
+        raise
@@ -0,0 +1,272 @@
+###################################################################################
+#
+#   Batch scoring of saved sketches with every scenario
+#
+#   Reads files of sketches a chunk of lines at a time, so memory use stays the
+#   same however large the files are. Each line is either:
+#         a sketchpad image as sent by the browser - 224x224 darkness readings
+#         (0 - 255), comma separated
+#         an MNIST-format record - label followed by 28x28 pixels (0 - 255)
+#         28x28 pixels (0 - 255) without a label
+#   (the format of each file is worked out from its first line; a header line
+#   of column names at the top of a file is skipped)
+#
+#   Every chunk is compressed (sketchpad images only) and run through the ANN
+#   for all scenarios in one batched forward pass - optionally spread across
+#   worker processes - and the prediction and confidence of every scenario
+#   is written to a CSV file, one row per sketch
+#
+#   run as:
+#         python batch_score.py sketches.txt mnist_test.csv --output scores.csv
+#                               --workers 4
+#
+#   calls:
+#         realtime_query.py
+#         model_registry.py (weights for each scenario)
+#         ANN.py
+#         worker_pools.py
+#
+###################################################################################
+
+# argparse for the command line options
+import argparse
+# collections.deque for the chunks being scored by worker processes
+from collections import deque
+# time for measuring rows per second
+import time
+# numpy for various mathematical actions (e.g. use of matrices)
+import numpy
+# global constants (see config.py)
+import config
+# access to ANN.py needed
+import ANN
+# weights for all scenarios, loaded once in each process
+import model_registry
+# compression of sketchpad images
+import realtime_query
+# pools of worker processes using one core each
+from worker_pools import single_threaded_workers
+
+# size of text read (and scored) at a time, in bytes - chunks are sized by
+# bytes rather than lines as a sketchpad line is around 50 times longer
+# than an MNIST line (8 MB is about 50 sketches or 3000 MNIST records)
+chunk_bytes = 8 * 1024 * 1024
+
+# number of values on a line in each format
+sketch_values = config.sketchpad_width * config.sketchpad_height
+pixel_values = config.pixel_width * config.pixel_height
+
+
+# format of a line: "sketch", "mnist" (label and pixels) or "pixels"
+def line_format(line):
+
+    num_values = line.count(',') + 1
+    formats = {
+        sketch_values: "sketch",
+        pixel_values + 1: "mnist",
+        pixel_values: "pixels"
+    }
+    if num_values not in formats:
+        raise ValueError("expected " + str(sketch_values) + ", " +
+                         str(pixel_values + 1) + " or " + str(pixel_values) +
+                         " values on a line, got " + str(num_values))
+
+    return formats[num_values]
+
+
+# True for a header line (column names rather than numbers)
+def is_header(line):
+
+    try:
+        float(line.split(',', 1)[0])
+        return False
+    except ValueError:
+        return True
+
+
+# chunks of non-blank lines from a file (of about num_bytes each), with the
+# format of the file
+def read_chunks(file_name, num_bytes=chunk_bytes):
+
+    file_format = None
+    lines = []
+    size = 0
+    with open(file_name, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if file_format is None:
+                if is_header(line):
+                    continue
+                file_format = line_format(line)
+            lines.append(line)
+            size += len(line)
+            if size >= num_bytes:
+                yield file_format, lines
+                lines = []
+                size = 0
+    if lines:
+        yield file_format, lines
+
+
+# inputs for the ANN (one row of 784 per line) and labels (None if the lines
+# have none) from a chunk of lines in the given format
+def parse_chunk(file_format, lines):
+
+    # parse the whole chunk straight into bytes (all values are 0 - 255),
+    # treating the ends of lines as separators too
+    try:
+        values = numpy.fromstring(",".join(line.strip() for line in lines),
+                                  dtype=numpy.uint8,
+                                  sep=',')
+    except ValueError:
+        # text that is not a number
+        values = None
+    values_per_line = {
+        "sketch": sketch_values,
+        "mnist": pixel_values + 1,
+        "pixels": pixel_values
+    }[file_format]
+    if values is None or values.size != len(lines) * values_per_line:
+        raise ValueError("expected " + str(values_per_line) +
+                         " numbers (0 - 255) on every line of a " +
+                         file_format + " file, found a line that is not")
+
+    if file_format == "sketch":
+        return realtime_query.compress_sketches(
+            values.reshape(-1, sketch_values)), None
+
+    if file_format == "mnist":
+        records = values.reshape(-1, pixel_values + 1)
+        labels = records[:, 0].astype(numpy.int64)
+        pixels = records[:, 1:]
+    else:
+        labels = None
+        pixels = values.reshape(-1, pixel_values)
+
+    return (pixels / 255.0 * 0.99) + 0.01, labels
+
+
+# score a chunk of lines: predicted digit and confidence (as a %, as shown
+# on the ANN page) for every scenario, one row per line
+def score_chunk(chunk):
+    #
+    #  chunk = (format of the lines, lines)
+    #
+    inputs, labels = parse_chunk(*chunk)
+
+    models = model_registry.get_models()
+    not_used, outputs = ANN.forward_prop_inference(inputs.T,
+                                                   models["inference"])
+    # (scenarios, 10 outputs, lines) -> (lines, scenarios, 10 outputs)
+    outputs = outputs.astype(numpy.float64).transpose(2, 0, 1)
+
+    predictions = numpy.argmax(outputs, axis=2)
+    # normalised as on the ANN page (see realtime_query.prediction_data)
+    confidences = numpy.round(
+        outputs.max(axis=2) / outputs.sum(axis=2) * 100, 2)
+
+    return labels, predictions, confidences
+
+
+# chunks of every input file, scored in this process or (workers > 0) across
+# a pool of workers - results come back in the order of the input, with
+# at most 2 chunks per worker in hand, so memory use stays bounded
+def scored_chunks(file_names, workers, num_bytes):
+
+    chunks = (chunk for file_name in file_names
+              for chunk in read_chunks(file_name, num_bytes))
+
+    if workers <= 0:
+        for chunk in chunks:
+            yield score_chunk(chunk)
+        return
+
+    # (the pool's workers are all started here, so the limit on their threads
+    # need not stay set in this process while chunks are scored)
+    with single_threaded_workers() as context:
+        pool = context.Pool(workers)
+
+    with pool:
+        in_hand = deque()
+        for chunk in chunks:
+            in_hand.append(pool.apply_async(score_chunk, (chunk, )))
+            if len(in_hand) >= 2 * workers:
+                yield in_hand.popleft().get()
+        while in_hand:
+            yield in_hand.popleft().get()
+
+
+# score every input file, writing one CSV row per sketch; returns the number
+# of rows and the number of correct predictions of each scenario (for
+# rows with labels)
+def score_files(file_names, output_file, workers, num_bytes=chunk_bytes):
+
+    num_scenarios = model_registry.num_scenarios
+    num_rows = 0
+    num_labelled = 0
+    correct = numpy.zeros(num_scenarios, dtype=numpy.int64)
+
+    with open(output_file, 'w') as f:
+        f.write("row,label," + ",".join(
+            "prediction_" + str(i) + ",confidence_" + str(i)
+            for i in range(num_scenarios)) + "\n")
+
+        for labels, predictions, confidences in scored_chunks(
+                file_names, workers, num_bytes):
+            rows = []
+            for k in range(len(predictions)):
+                label = "" if labels is None else str(labels[k])
+                rows.append(
+                    str(num_rows + k) + "," + label + "," + ",".join(
+                        str(predictions[k, i]) + "," + str(confidences[k, i])
+                        for i in range(num_scenarios)))
+            f.write("\n".join(rows) + "\n")
+
+            if labels is not None:
+                num_labelled += len(labels)
+                correct += (predictions == labels[:, None]).sum(axis=0)
+            num_rows += len(predictions)
+
+    return num_rows, num_labelled, correct
+
+
+# this if statement stops the code below being executed when this file is imported
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Score files of sketches with every scenario")
+    parser.add_argument("inputs", nargs="+", help="files of sketches")
+    parser.add_argument("--output", default="scores.csv")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=0,
+                        help="worker processes (0 = score in this process)")
+    parser.add_argument("--chunk-bytes",
+                        type=int,
+                        default=chunk_bytes,
+                        help="size of text scored at a time")
+    args = parser.parse_args()
+
+    # load the weights before timing (workers load their own)
+    model_registry.get_models()
+
+    tic = time.perf_counter()
+    try:
+        num_rows, num_labelled, correct = score_files(args.inputs,
+                                                      args.output,
+                                                      args.workers,
+                                                      args.chunk_bytes)
+    except ValueError as error:
+        raise SystemExit("Could not score " + ", ".join(args.inputs) + ": " +
+                         str(error))
+    seconds = time.perf_counter() - tic
+
+    print("Scored " + str(num_rows) + " rows in " + f"{seconds:0.2f}" +
+          " seconds (" + f"{num_rows / max(seconds, 1e-9):0.0f}" +
+          " rows/second), written to " + args.output)
+    if num_labelled:
+        print("Accuracy on " + str(num_labelled) + " labelled rows: " +
+              ", ".join("scenario " + str(i) + " " +
+                        f"{correct[i] / num_labelled * 100:0.2f}%"
+                        for i in range(len(correct))))
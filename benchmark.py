@@ -0,0 +1,268 @@
+###################################################################################
+#
+#   Offline benchmark suite
+#
+#   Generates synthetic data locally (MNIST-format CSV files, 224x224 sketchpad
+#   strings and random weights), so it runs on a clean machine without the MNIST
+#   datasets, and times:
+#         compress_image, process_image
+#         ANN.forward_prop / backward_prop (one record and a batch of records)
+#         dataset loading (parsing the CSV and loading the cache)
+#         training (samples per second) and test-set evaluation
+#
+#   Everything runs in a temporary directory, so weights and test scores of the
+#   real application are never touched. Results are written as JSON and can be
+#   compared with an earlier run to catch regressions:
+#         python benchmark.py --output benchmark_results.json
+#         python benchmark.py --compare benchmark_results.json
+#
+###################################################################################
+
+# argparse for the command line options
+import argparse
+# json for the results file
+import json
+# os, platform, subprocess and tempfile for the run environment
+import os
+import platform
+import subprocess
+import tempfile
+# time for timing
+import time
+# numpy for various mathematical actions (e.g. use of matrices)
+import numpy
+# code being benchmarked
+import ANN
+import config
+import mnist_data
+import model_files
+import model_registry
+import realtime_query
+import train_and_test
+
+# a benchmark is reported as a regression when it is this much slower
+regression_ratio = 1.2
+
+
+# write a synthetic MNIST-format CSV file (label, then 784 pixels 0 - 255):
+# a few random strokes on a blank 28x28 image for each record
+def synthetic_mnist_csv(file_name, num_records, seed=0):
+
+    rng = numpy.random.default_rng(seed)
+
+    with open(file_name, 'w') as f:
+        for record in range(num_records):
+            image = numpy.zeros((28, 28), dtype=numpy.uint8)
+            for stroke in range(rng.integers(1, 4)):
+                row, col = rng.integers(4, 24, 2)
+                height, width = rng.integers(2, 12, 2)
+                image[row:row + height, col:col + 3] = 255
+                image[row:row + 3, col:col + width] = rng.integers(128, 256)
+            f.write(
+                str(rng.integers(0, 10)) + ',' +
+                ','.join(map(str, image.ravel())) + '\n')
+
+
+# synthetic sketchpad image as sent by the browser: 224x224 darkness readings
+# (0 - 255) as a comma separated string, with a few thick strokes
+def synthetic_sketch_string(seed=0):
+
+    rng = numpy.random.default_rng(seed)
+    image = numpy.zeros((config.sketchpad_height, config.sketchpad_width),
+                        dtype=numpy.uint8)
+
+    for stroke in range(rng.integers(1, 4)):
+        row, col = rng.integers(30, 150, 2)
+        length = rng.integers(20, 70)
+        image[row:row + length, col:col + 10] = 255
+        image[row:row + 10, col:col + length] = 255
+
+    return ','.join(map(str, image.ravel()))
+
+
+# write random weights for every scenario and test scores, as the real
+# application expects to find them
+def synthetic_models():
+
+    rng = numpy.random.default_rng(0)
+
+    for i in range(len(config.scenarios)):
+        wih, who = train_and_test.initialise_for_train_and_test()
+        wih += rng.normal(0.0, 0.01, wih.shape)
+        model_files.save_model(model_files.model_file(i), wih, who,
+                               {"scenario": i})
+
+    train_and_test.save_test_scores(["10.0%"] * len(config.scenarios))
+
+
+# time calls to function, repeating number calls repeat times, and give the
+# seconds per call of the fastest and median repeat
+def measure(function, number=10, repeat=5):
+
+    times = []
+    for r in range(repeat):
+        tic = time.perf_counter()
+        for n in range(number):
+            function()
+        toc = time.perf_counter()
+        times.append((toc - tic) / number)
+
+    return {"best": min(times), "median": float(numpy.median(times))}
+
+
+# run all benchmarks, returning results by name
+def run_benchmarks(num_train, num_test, batch_size):
+
+    results = {}
+
+    synthetic_mnist_csv("mnist_train.csv", num_train, seed=1)
+    synthetic_mnist_csv("mnist_test.csv", num_test, seed=2)
+    synthetic_models()
+    model_registry.load_models()
+
+    # realtime queries (different sketches, so the prediction cache misses)
+    sketches = [synthetic_sketch_string(seed) for seed in range(64)]
+    results["compress_image"] = measure(
+        lambda: realtime_query.compress_image(sketches[0]), number=50)
+    config.prediction_cache_size = 0
+    queries = iter(range(10**9))
+
+    def query_next_sketch():
+        realtime_query.process_image(sketches[next(queries) % len(sketches)])
+
+    results["process_image"] = measure(query_next_sketch, number=50)
+
+    # forward and backward propagation, one record and a batch of records
+    wih, who = train_and_test.initialise_for_train_and_test()
+    images, labels = mnist_data.parse_csv("mnist_train.csv")
+    for name, num_records in (("1", 1), ("batch", batch_size)):
+        inputs = mnist_data.scale_inputs(images[0:num_records]).T
+        targets = numpy.zeros((10, num_records)) + 0.01
+        targets[labels[0:num_records], numpy.arange(num_records)] = 0.99
+        hidden_outputs, final_outputs = ANN.forward_prop(inputs, wih, who)
+        results["forward_prop_" + name] = measure(
+            lambda: ANN.forward_prop(inputs, wih, who), number=50)
+        results["backward_prop_" + name] = measure(
+            lambda: ANN.backward_prop(inputs, hidden_outputs, final_outputs,
+                                      targets, wih, who),
+            number=50)
+
+    # dataset loading: parsing the CSV, and loading the cache made from it
+    results["parse_csv"] = measure(
+        lambda: mnist_data.parse_csv("mnist_train.csv"), number=1, repeat=3)
+    mnist_data.load_dataset("mnist_train.csv")
+    results["load_dataset_cached"] = measure(
+        lambda: mnist_data.load_dataset("mnist_train.csv"), number=10)
+
+    # training speed (per-record updates, as in config.configuration)
+    images, labels = mnist_data.load_dataset("mnist_train.csv")
+
+    def train_epoch():
+        step = config.configuration["batch_size"]
+        for start in range(0, len(labels), step):
+            train_and_test.training_step(images[start:start + step],
+                                         labels[start:start + step], wih,
+                                         who)
+
+    timing = measure(train_epoch, number=1, repeat=3)
+    timing["samples_per_second"] = len(labels) / timing["best"]
+    results["training_epoch"] = timing
+
+    # evaluation of the whole test set
+    test_data = mnist_data.load_dataset("mnist_test.csv")
+    results["evaluation"] = measure(
+        lambda: train_and_test.evaluation(test_data, wih, who), number=1)
+
+    return results
+
+
+# details of the machine and code the benchmarks ran on
+def environment():
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True,
+                                text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count()
+    }
+
+
+# print results, and how they compare with an earlier run if given;
+# returns the names of benchmarks that got slower by more than regression_ratio
+def report(results, previous=None):
+
+    regressions = []
+
+    print(f"{'benchmark':<24}{'best (ms)':>12}{'median (ms)':>13}"
+          f"{'change':>10}")
+    for name, timing in results.items():
+        line = (f"{name:<24}{timing['best'] * 1000:>12.3f}"
+                f"{timing['median'] * 1000:>13.3f}")
+        if previous is not None and name in previous:
+            ratio = timing["best"] / previous[name]["best"]
+            line += f"{ratio:>9.2f}x"
+            if ratio > regression_ratio:
+                line += "  SLOWER"
+                regressions.append(name)
+        print(line)
+
+    if "training_epoch" in results:
+        print(f"training: "
+              f"{results['training_epoch']['samples_per_second']:0.0f}"
+              f" samples/second")
+
+    return regressions
+
+
+# this if statement stops the code below being executed when this file is imported
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run offline benchmarks")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare",
+                        help="earlier results file to compare against")
+    parser.add_argument("--train-records", type=int, default=6000)
+    parser.add_argument("--test-records", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)["results"]
+
+    # run in a temporary directory, so no real files are changed
+    start_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            results = run_benchmarks(args.train_records, args.test_records,
+                                     args.batch_size)
+        finally:
+            os.chdir(start_directory)
+
+    with open(output, 'w') as f:
+        json.dump({
+            "environment": environment(),
+            "results": results
+        },
+                  f,
+                  indent=2)
+
+    regressions = report(results, previous)
+    print("Results written to " + output)
+    if regressions:
+        print("Slower than before: " + ", ".join(regressions))
+        raise SystemExit(1)
@@ -0,0 +1,82 @@
+###################################################################################
+#
+#   Checkpoints of training runs, so an interrupted run can be resumed
+#
+#   A checkpoint is an uncompressed numpy archive holding:
+#         arrays - e.g. the weights so far and the initial weights of the run
+#         rng_* - state of numpy's random number generator
+#         state - position in the run and anything else needed to continue
+#                 it (as JSON)
+#
+#   Checkpoints are written atomically (see atomic_files.py), so a crash (or
+#   power cut) part way through writing one leaves the previous checkpoint
+#   intact
+#
+#   called from:
+#         train_and_test.py
+#
+#   calls:
+#         atomic_files.py
+#
+###################################################################################
+
+# json for the state stored alongside the arrays
+import json
+# os for finding and removing checkpoints
+import os
+# numpy for various mathematical actions (e.g. use of matrices)
+import numpy
+# writing files atomically
+import atomic_files
+
+
+# save a checkpoint: arrays (by name), state (JSON-serialisable dict) and
+# the state of numpy's random number generator
+def save_checkpoint(file_name, arrays, state):
+
+    algorithm, keys, position, has_gauss, cached_gaussian = (
+        numpy.random.get_state())
+    state = dict(state)
+    state["rng"] = {
+        "algorithm": algorithm,
+        "position": int(position),
+        "has_gauss": int(has_gauss),
+        "cached_gaussian": float(cached_gaussian)
+    }
+
+    atomic_files.write_atomically(
+        file_name, lambda f: numpy.savez(f,
+                                         rng_keys=keys,
+                                         state=numpy.array(json.dumps(state)),
+                                         **arrays))
+
+
+# load a checkpoint, returning its arrays and state (or None, None if there
+# is no checkpoint) and restoring numpy's random number generator
+def load_checkpoint(file_name):
+
+    if not os.path.exists(file_name):
+        return None, None
+
+    with numpy.load(file_name) as archive:
+        state = json.loads(str(archive["state"]))
+        rng_keys = archive["rng_keys"]
+        arrays = {
+            name: archive[name]
+            for name in archive.files if name not in ("state", "rng_keys")
+        }
+
+    rng = state.pop("rng")
+    numpy.random.set_state((rng["algorithm"], rng_keys, rng["position"],
+                            rng["has_gauss"], rng["cached_gaussian"]))
+
+    return arrays, state
+
+
+# remove a checkpoint (e.g. once the run it belongs to has finished)
+def remove_checkpoint(file_name):
+
+    try:
+        os.remove(file_name)
+    except FileNotFoundError:
+        pass
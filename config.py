@@ -0,0 +1,103 @@
+###################################################################################
+#
+#   Global constants for the application, training and testing
+#
+#   Kept apart from main.py (and importing nothing), so that training, testing
+#   and any other jobs can read the configuration without loading Flask and
+#   the rest of the web application
+#
+#   called from:
+#         main.py (which re-exports the constants it used to define)
+#         ANN.py, realtime_query.py, train_and_test.py and other modules
+#
+###################################################################################
+
+# ANN configuration data
+configuration = {
+    "input_nodes": 784,  # number of nodes in input layer
+    "hidden_nodes": 200,  # number of nodes in hidden layer
+    "output_nodes": 10,  # number of nodes in output layer
+    "learning_rate": 0.1,  # step size for gradient descent
+    "batch_size": 1  # number of records per update of weights (1 = per record)
+}
+
+# ANN training scenarios
+# "num_lines" = number of records (samples) to be read from MNIST training dataset
+# "num_epochs" = number of epochs (i.e. iterations through training datatset)
+scenarios = [{
+    "num_lines": 600,
+    "num_epochs": 1
+}, {
+    "num_lines": 6000,
+    "num_epochs": 1
+}, {
+    "num_lines": 60000,
+    "num_epochs": 1
+}, {
+    "num_lines": 60000,
+    "num_epochs": 5
+}]
+
+# scenario whose ranked digits and confidence band are shown on the ANN page
+# (the last, most trained one)
+headline_scenario = len(scenarios) - 1
+
+# training records between checkpoints of a training run (as well as one at
+# the end of every epoch), so an interrupted run can be resumed with
+# "python train_and_test.py --resume" (0 = only at the end of every epoch)
+checkpoint_interval = 10000
+
+# confidence band thresholds
+high_threshold = 90.00
+medium_threshold = 60.00
+low_threshold = 20.00
+
+# precision used by the ANN to answer queries: "float64" (as trained) or
+# "float32" - only used if accuracy on the MNIST test dataset stays within
+# precision_margin % points of test_scores.csv. float32 halves the stacked
+# weights read by every query, roughly halving the time of each query; the
+# float64 weights of each scenario (memory-mapped from the model files) are
+# still held for reloads, precision changes and fine-tuning, so total
+# memory in use falls by a quarter, not a half
+inference_precision = "float64"
+precision_margin = 0.5
+
+# number of recent predictions kept in memory, so re-submits of the same
+# sketch are answered without querying the ANN again
+prediction_cache_size = 1024
+
+# micro-batching of concurrent queries (see inference_scheduler.py):
+# queries are run together in batches of up to max_batch_size, waiting up to
+# batch_window seconds for others to join (0 = only batch queries that arrive
+# while an earlier batch is being run, so a lone query is never delayed)
+micro_batching = True
+batch_window = 0.0
+max_batch_size = 32
+
+# online fine-tuning of the headline scenario from sketches labelled by users
+# (see fine_tuning.py): updated weights are published every
+# fine_tune_publish_interval sketches, provided accuracy on the first
+# fine_tune_holdout_size records of the MNIST test dataset is no more than
+# fine_tune_rollback_margin % points below that of the trained weights
+# (otherwise they are rolled back); at most fine_tune_queue_size sketches
+# wait to be trained on. Off by default; each process would fine-tune its own
+# copy, so serve.py switches it off unless it runs a single worker that is
+# never recycled
+online_fine_tuning = False
+fine_tune_scenario = headline_scenario
+fine_tune_publish_interval = 20
+fine_tune_holdout_size = 1000
+fine_tune_rollback_margin = 1.0
+fine_tune_queue_size = 1000
+
+# seconds browsers may keep files from static/ (css, js, images) before
+# checking back - they are not versioned, so a week rather than a year
+static_max_age = 7 * 24 * 3600
+
+# pixel dimensions
+pixel_width = 28
+pixel_height = 28
+
+# sketchpad dimensions (as drawn in browser, before compression to pixels above)
+sketchpad_width = 224
+sketchpad_height = 224
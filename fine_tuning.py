@@ -0,0 +1,377 @@
+###################################################################################
+#
+#   Online fine-tuning of the headline scenario from sketches labelled by users
+#
+#   Sketches drawn on the sketchpad differ from the MNIST digits the ANN was
+#   trained on. When a user confirms or corrects a prediction (feedback route in
+#   main.py) the sketch and its label are queued for a background worker and the
+#   request returns at once. The worker trains its own (shadow) copy of the
+#   weights of scenario fine_tune_scenario with ANN.backward_prop, one sketch at
+#   a time, while queries carry on with the published weights
+#
+#   Every fine_tune_publish_interval sketches the shadow weights are checked on
+#   a held-out sample of the MNIST test dataset:
+#         accuracy no more than fine_tune_rollback_margin % points below that of
+#         the trained weights - a frozen copy of the shadow weights is published
+#         (swapped into model_registry.py as a new set of weights, so queries
+#         never wait on training) and snapshotted to disk
+#         otherwise - the shadow weights are rolled back to the last snapshot
+#
+#   Fine-tuning starts again from the trained weights whenever new weight files
+#   are loaded (e.g. written by train_and_test.py). It is only active if the
+#   held-out sample could be loaded at startup (see start), and only in a
+#   single server process (see online_fine_tuning in config.py)
+#
+#   Undo fine-tuning (removes the snapshot; running servers go back to the
+#   trained weights when their watcher notices the touched weight files):
+#         python fine_tuning.py --reset
+#
+#   called from:
+#         main.py
+#
+#   calls:
+#         ANN.py
+#         model_registry.py
+#         model_files.py (snapshots)
+#         mnist_data.py (held-out sample)
+#
+#   files written to:
+#         fine_tuned_model.npz - last published fine-tuned weights, swapped in
+#                                again at startup while the trained weights
+#                                they were fine-tuned from are unchanged
+#
+###################################################################################
+
+# argparse for the command line options
+import argparse
+# json for comparing the trained weights of a snapshot with those in use
+import json
+# os for removing the snapshot on reset
+import os
+# threading for the background worker
+import threading
+# numpy for various mathematical actions (e.g. use of matrices)
+import numpy
+# access to ANN.py needed
+import ANN
+# weights for all scenarios, where fine-tuned weights are published
+import model_registry
+# binary model files, for snapshots
+import model_files
+# MNIST test dataset, for the held-out sample
+import mnist_data
+# global constants (see config.py)
+import config
+
+# last published fine-tuned weights
+snapshot_file = "fine_tuned_model.npz"
+
+# labelled sketches waiting to be trained on, oldest first
+_pending = []
+# protects _pending and wakes the worker when a sketch arrives
+_condition = threading.Condition()
+# background worker thread (started by the first labelled sketch)
+_worker = None
+
+# held-out sample of the MNIST test dataset (None until start is called -
+# fine-tuning is only active once it has been loaded)
+_holdout = None
+
+# serialises publishing weights and snapshots with restoring a snapshot
+_publish_lock = threading.Lock()
+
+# held-out accuracy of the trained weights behind a restored snapshot, as
+# (published wih, accuracy), so restarts do not lower the bar for rollback
+_restored = None
+
+# counts of sketches and of checks of the shadow weights
+_stats = {
+    "received": 0,
+    "dropped": 0,
+    "trained": 0,
+    "published": 0,
+    "rolled_back": 0,
+    "runs": 0,
+    "baseline_accuracy": None,
+    "holdout_accuracy": None
+}
+_stats_lock = threading.Lock()
+
+
+# queue a sketch (784 inputs, as used by the ANN) labelled by a user for
+# fine-tuning - returns False if too many sketches are waiting already;
+# raises ValueError for a label that is not a digit
+def submit(inputs_list, label):
+
+    if (not isinstance(label, int) or isinstance(label, bool)
+            or not 0 <= label < 10):
+        raise ValueError("label must be a digit 0 - 9, got " + repr(label))
+
+    with _condition:
+        with _stats_lock:
+            _stats["received"] += 1
+            if len(_pending) >= config.fine_tune_queue_size:
+                _stats["dropped"] += 1
+                return False
+        start_worker()
+        _pending.append((numpy.asarray(inputs_list, dtype=numpy.float64),
+                         label))
+        _condition.notify()
+
+    return True
+
+
+# start the background worker if it is not running
+# (caller holds _condition)
+def start_worker():
+    global _worker
+
+    if _worker is None or not _worker.is_alive():
+        _worker = threading.Thread(target=run,
+                                   name="fine-tuning",
+                                   daemon=True)
+        _worker.start()
+
+
+# wait for labelled sketches and take all those waiting
+def take_sketches():
+
+    with _condition:
+        while not _pending:
+            _condition.wait()
+        sketches = list(_pending)
+        del _pending[:]
+
+    return sketches
+
+
+# held-out sample of the MNIST test dataset: inputs (one column per record)
+# and labels
+def holdout_sample():
+
+    images, labels = mnist_data.load_dataset("mnist_test.csv")
+    size = config.fine_tune_holdout_size
+    if len(labels) == 0:
+        raise ValueError("no records in mnist_test.csv to check against")
+
+    return mnist_data.scale_inputs(images[:size]).T, numpy.array(labels[:size])
+
+
+# make fine-tuning active by loading the held-out sample it is checked
+# against - raises OSError or ValueError if there is none (e.g. no
+# mnist_test.csv), leaving fine-tuning inactive
+def start():
+    global _holdout
+
+    _holdout = holdout_sample()
+
+
+# True once fine-tuning is active (see start)
+def is_active():
+    return _holdout is not None
+
+
+# accuracy (%) of weights wih, who on the held-out sample
+def holdout_accuracy(holdout, wih, who):
+
+    inputs, labels = holdout
+    not_used, outputs = ANN.forward_prop(inputs, wih, who)
+
+    return float(numpy.mean(numpy.argmax(outputs, axis=0) == labels) * 100)
+
+
+# start fine-tuning from the weights currently published for the scenario
+def new_run(models, holdout):
+
+    i = config.fine_tune_scenario
+    published_wih, published_who = models["wih"][i], models["who"][i]
+
+    if _restored is not None and _restored[0] is published_wih:
+        baseline = _restored[1]
+    else:
+        baseline = holdout_accuracy(holdout, published_wih, published_who)
+
+    with _stats_lock:
+        _stats["runs"] += 1
+        _stats["baseline_accuracy"] = baseline
+        _stats["holdout_accuracy"] = baseline
+
+    return {
+        "signature": models["signature"],
+        # shadow weights, trained in place (never seen by queries)
+        "wih": numpy.array(published_wih),
+        "who": numpy.array(published_who),
+        # last published weights (frozen, shared with queries)
+        "published_wih": published_wih,
+        "published_who": published_who,
+        "baseline_accuracy": baseline,
+        "since_check": 0
+    }
+
+
+# train the shadow weights on one labelled sketch
+def train_sketch(run_state, inputs_list, label):
+
+    inputs = inputs_list.reshape(-1, 1)
+    targets = numpy.full((config.configuration["output_nodes"], 1), 0.01)
+    targets[label] = 0.99
+
+    hidden_outputs, output_outputs = ANN.forward_prop(inputs, run_state["wih"],
+                                                      run_state["who"])
+    ANN.backward_prop(inputs, hidden_outputs, output_outputs, targets,
+                      run_state["wih"], run_state["who"])
+    run_state["since_check"] += 1
+
+    with _stats_lock:
+        _stats["trained"] += 1
+
+
+# check the shadow weights on the held-out sample, then publish them (and
+# snapshot them to disk) or roll them back to the last published weights -
+# returns False if other weights were swapped in since the run started
+def check_and_publish(run_state, holdout):
+
+    run_state["since_check"] = 0
+    accuracy = holdout_accuracy(holdout, run_state["wih"], run_state["who"])
+
+    if accuracy < (run_state["baseline_accuracy"] -
+                   config.fine_tune_rollback_margin):
+        numpy.copyto(run_state["wih"], run_state["published_wih"])
+        numpy.copyto(run_state["who"], run_state["published_who"])
+        with _stats_lock:
+            _stats["rolled_back"] += 1
+        print("Fine-tuning rolled back: held-out accuracy " +
+              f"{accuracy:0.2f}% against " +
+              f"{run_state['baseline_accuracy']:0.2f}%")
+        return True
+
+    # copies to publish, so training carries on in the shadow weights
+    wih = numpy.array(run_state["wih"])
+    who = numpy.array(run_state["who"])
+
+    with _publish_lock:
+        models = model_registry.publish_weights(config.fine_tune_scenario,
+                                                wih, who,
+                                                run_state["published_wih"])
+        if models is None:
+            return False
+        model_files.save_model(
+            snapshot_file, wih, who, {
+                "scenario": config.fine_tune_scenario,
+                "trained_signature": run_state["signature"],
+                "baseline_accuracy": run_state["baseline_accuracy"],
+                "holdout_accuracy": accuracy
+            })
+    # (published in float64, until checked in a reduced precision)
+    model_registry.apply_precision()
+
+    run_state["published_wih"] = wih
+    run_state["published_who"] = who
+    with _stats_lock:
+        _stats["published"] += 1
+        _stats["holdout_accuracy"] = accuracy
+
+    return True
+
+
+# background worker: train on labelled sketches as they arrive, for ever
+def run():
+
+    run_state = None
+    holdout = _holdout
+
+    while True:
+        sketches = take_sketches()
+
+        try:
+            models = model_registry.get_models()
+            # other weights swapped in (new weight files) - start again
+            if run_state is None or (models["wih"][config.fine_tune_scenario]
+                                     is not run_state["published_wih"]):
+                run_state = new_run(models, holdout)
+
+            for inputs_list, label in sketches:
+                train_sketch(run_state, inputs_list, label)
+                if run_state[
+                        "since_check"] >= config.fine_tune_publish_interval:
+                    if not check_and_publish(run_state, holdout):
+                        run_state = new_run(model_registry.get_models(),
+                                            holdout)
+        except (OSError, ValueError) as error:
+            # e.g. the snapshot could not be written - keep the worker running
+            print("Fine-tuning failed: " + str(error))
+
+
+# swap in the snapshot of fine-tuned weights at startup, provided it was
+# fine-tuned from the trained weights now in use - returns True if it was
+def restore_snapshot():
+    global _restored
+
+    if not os.path.exists(snapshot_file):
+        return False
+
+    wih, who, metadata = model_files.load_model(snapshot_file)
+    i = metadata["scenario"]
+
+    with _publish_lock:
+        models = model_registry.get_models()
+        # (signature is stored as JSON, so compare it as JSON)
+        if (i != config.fine_tune_scenario
+                or metadata["trained_signature"] != json.loads(
+                    json.dumps(models["signature"]))):
+            return False
+        wih, who = numpy.array(wih), numpy.array(who)
+        if model_registry.publish_weights(i, wih, who,
+                                          models["wih"][i]) is None:
+            return False
+        _restored = (wih, metadata["baseline_accuracy"])
+    model_registry.apply_precision()
+
+    return True
+
+
+# undo fine-tuning: remove the snapshot and touch the trained weight files of
+# the scenario, so running servers reload them (see model_registry.watch)
+# and a snapshot written meanwhile no longer matches them
+def reset():
+
+    try:
+        os.remove(snapshot_file)
+    except FileNotFoundError:
+        pass
+
+    i = config.fine_tune_scenario
+    for file_name in ((model_files.model_file(i), ) +
+                      model_files.weight_files(i)):
+        if os.path.exists(file_name):
+            os.utime(file_name)
+
+
+# counts of sketches and checks, and sketches waiting to be trained on
+def get_fine_tuning_stats():
+
+    with _stats_lock:
+        stats = dict(_stats)
+    with _condition:
+        stats["waiting"] = len(_pending)
+
+    return stats
+
+
+# this if statement stops the code below being executed when this file is imported
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Manage online fine-tuning")
+    parser.add_argument("--reset",
+                        action="store_true",
+                        help="undo fine-tuning, going back to the trained "
+                        "weights")
+    args = parser.parse_args()
+
+    if args.reset:
+        reset()
+        print("Fine-tuning undone: running servers reload the trained "
+              "weights within " + str(model_registry.watch_interval * 2) +
+              " seconds")
+    else:
+        parser.print_help()
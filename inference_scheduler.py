@@ -0,0 +1,163 @@
+###################################################################################
+#
+#   Micro-batching scheduler for queries to the artificial neural network
+#
+#   Concurrent requests (e.g. from Flask's threaded server) hand their query to
+#   a single background worker instead of each running their own small matrix
+#   multiplications. The worker collects the queries waiting - for up to
+#   batch_window seconds after the first, or until max_batch_size are waiting -
+#   stacks their inputs into one matrix, runs one batched forward pass and hands
+#   each caller back its own result
+#
+#   With batch_window = 0 the worker never waits on purpose: a query arriving
+#   while a batch is being run simply joins the next batch, so a lone request
+#   is not delayed and batches form by themselves under load
+#
+#   called from:
+#         realtime_query.py
+#
+###################################################################################
+
+# threading for the background worker and for handing results back to callers
+import threading
+# time for measuring how long queries wait to be run
+import time
+# timings of each stage of processing a query
+import metrics
+# global constants (see config.py)
+import config
+
+# queries waiting to be run, oldest first
+_pending = []
+# protects _pending and wakes the worker when a query arrives
+_condition = threading.Condition()
+# background worker thread (started by the first query)
+_worker = None
+
+# batch size and queue wait statistics
+_stats = {
+    "batches": 0,
+    "queries": 0,
+    "max_batch_size": 0,
+    "queue_wait_seconds": 0.0,
+    "max_queue_wait_seconds": 0.0
+}
+_stats_lock = threading.Lock()
+
+
+# run a query in the next batch and wait for its result:
+# batch_function(models, [inputs, ...]) must return one result per inputs,
+# and is called with the inputs of every waiting query for the same
+# batch_function and models
+def submit(batch_function, models, inputs):
+
+    query = {
+        "done": threading.Event(),
+        "result": None,
+        "error": None,
+        "queued": time.perf_counter()
+    }
+
+    with _condition:
+        start_worker()
+        _pending.append((batch_function, models, inputs, query))
+        _condition.notify()
+
+    query["done"].wait()
+    if query["error"] is not None:
+        raise query["error"]
+
+    return query["result"]
+
+
+# start the background worker if it is not running
+# (caller holds _condition)
+def start_worker():
+    global _worker
+
+    if _worker is None or not _worker.is_alive():
+        _worker = threading.Thread(target=run,
+                                   name="inference-scheduler",
+                                   daemon=True)
+        _worker.start()
+
+
+# wait for queries and take the next batch of them
+def take_batch():
+
+    with _condition:
+        while not _pending:
+            _condition.wait()
+
+        # give other queries up to batch_window seconds to join the batch
+        deadline = time.perf_counter() + config.batch_window
+        while len(_pending) < config.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            _condition.wait(remaining)
+
+        batch = _pending[:config.max_batch_size]
+        del _pending[:config.max_batch_size]
+
+    return batch
+
+
+# record statistics for a batch about to be run
+def record_batch(batch, started):
+
+    waits = [started - query["queued"] for f, m, i, query in batch]
+    for wait in waits:
+        metrics.observe("ann_stage_seconds", wait, stage="scheduler_wait")
+
+    with _stats_lock:
+        _stats["batches"] += 1
+        _stats["queries"] += len(batch)
+        _stats["max_batch_size"] = max(_stats["max_batch_size"], len(batch))
+        _stats["queue_wait_seconds"] += sum(waits)
+        _stats["max_queue_wait_seconds"] = max(
+            _stats["max_queue_wait_seconds"], max(waits))
+
+
+# background worker: run waiting queries in batches, for ever
+def run():
+
+    while True:
+        batch = take_batch()
+
+        # queries can only share a forward pass if they use the same weights
+        # (e.g. not across a reload of weights)
+        groups = {}
+        for item in batch:
+            groups.setdefault((id(item[0]), id(item[1])), []).append(item)
+
+        for group in groups.values():
+            batch_function, models = group[0][0], group[0][1]
+            record_batch(group, time.perf_counter())
+            try:
+                results = batch_function(models, [item[2] for item in group])
+                for item, result in zip(group, results):
+                    item[3]["result"] = result
+            except Exception as error:
+                # hand the error to every caller in the batch
+                for item in group:
+                    item[3]["error"] = error
+            finally:
+                for item in group:
+                    item[3]["done"].set()
+
+
+# batch size and queue wait statistics
+def get_scheduler_stats():
+
+    with _stats_lock:
+        stats = dict(_stats)
+
+    batches = max(stats["batches"], 1)
+    stats["mean_batch_size"] = stats["queries"] / batches
+    stats["mean_queue_wait_seconds"] = stats["queue_wait_seconds"] / max(
+        stats["queries"], 1)
+    with _condition:
+        stats["waiting"] = len(_pending)
+
+    return stats
@@ -0,0 +1,324 @@
+###################################################################################
+#
+#   Load test of the web application
+#
+#   Simulates concurrent users - each a thread sending one request after another
+#   for a set time - spread across the pages in proportion to route_weights:
+#         /Home, /Info, /Quiz, GET /ANN
+#         POST /ANN - a synthetic sketch in the sketchpad_image form field,
+#                     exactly as sent by the browser (224x224 darkness readings)
+#
+#   Requests go either to Flask's test client in this process (the default -
+#   no server needed), or over HTTP to a server on this machine, which can be
+#   started by the load test itself (serve.py). Nothing is fetched from the
+#   network. Each user follows its own seeded sequence of requests, so runs
+#   with the same options send the same requests and can be compared
+#   between commits:
+#         python loadtest.py --concurrency 8 --duration 30 --output load.json
+#         python loadtest.py --start-server --workers 4 --compare load.json
+#
+#   Reports requests per second and p50/p95/p99 latency for every route
+#
+#   calls:
+#         main.py (test client)
+#         serve.py (started server)
+#         benchmark.py (synthetic sketches, run environment)
+#
+###################################################################################
+
+# argparse for the command line options
+import argparse
+# http.client for requests to a server
+import http.client
+# json for the results file
+import json
+# os, socket, subprocess and sys for starting a server on a free port
+import os
+import socket
+import subprocess
+import sys
+# threading for the simulated users
+import threading
+# time for timing
+import time
+# urllib.parse for encoding the sketchpad form
+import urllib.parse
+# numpy for random choices and percentiles
+import numpy
+# synthetic sketches and the run environment (see benchmark.py)
+import benchmark
+
+# share of requests sent to each route (method, path)
+route_weights = {
+    ("GET", "/Home"): 1,
+    ("GET", "/Info"): 1,
+    ("GET", "/Quiz"): 1,
+    ("GET", "/ANN"): 2,
+    ("POST", "/ANN"): 5
+}
+
+# number of different synthetic sketches sent (re-submits of the same sketch
+# are answered from the prediction cache, as for real users)
+num_sketches = 200
+
+
+# sketchpad forms as sent by the browser for a set of synthetic sketches
+def sketch_forms(count):
+    return [
+        urllib.parse.urlencode(
+            {"sketchpad_image": benchmark.synthetic_sketch_string(seed)})
+        for seed in range(count)
+    ]
+
+
+# send one request with Flask's test client; returns the status code
+def client_request(client, method, path, body):
+
+    if method == "POST":
+        response = client.post(
+            path,
+            data=body,
+            content_type="application/x-www-form-urlencoded")
+    else:
+        response = client.get(path)
+    response.get_data()
+
+    return response.status_code
+
+
+# send one request over HTTP to host:port; returns the status code
+def http_request(address, method, path, body):
+
+    connection = http.client.HTTPConnection(*address, timeout=60)
+    try:
+        headers = {}
+        if method == "POST":
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+# one simulated user: send requests until the end time, recording
+# (route, seconds, ok) for those started after the warm-up
+def simulated_user(send, seed, forms, warm_up_end, end, timings):
+
+    rng = numpy.random.default_rng(seed)
+    routes = list(route_weights)
+    weights = numpy.array(list(route_weights.values()), dtype=float)
+    weights /= weights.sum()
+
+    while True:
+        method, path = routes[rng.choice(len(routes), p=weights)]
+        body = forms[rng.integers(len(forms))] if method == "POST" else None
+
+        tic = time.perf_counter()
+        if tic >= end:
+            break
+        try:
+            ok = send(method, path, body) == 200
+        except (OSError, http.client.HTTPException):
+            ok = False
+        toc = time.perf_counter()
+
+        if tic >= warm_up_end:
+            timings.append((method + " " + path, toc - tic, ok))
+
+
+# run the load test, returning the results for every route
+def run_load_test(make_sender, concurrency, duration, warm_up):
+
+    forms = sketch_forms(num_sketches)
+    timings = []
+
+    start = time.perf_counter()
+    warm_up_end = start + warm_up
+    end = warm_up_end + duration
+    users = [
+        threading.Thread(target=simulated_user,
+                         args=(make_sender(), seed, forms, warm_up_end, end,
+                               timings)) for seed in range(concurrency)
+    ]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+
+    return summarise(timings, duration)
+
+
+# throughput, errors and latency percentiles for each route (and all routes)
+def summarise(timings, duration):
+
+    results = {}
+    names = sorted(set(name for name, seconds, ok in timings))
+
+    for name in names + ["all"]:
+        seconds = numpy.array([
+            timing[1] for timing in timings
+            if name == "all" or timing[0] == name
+        ])
+        errors = sum(1 for timing in timings
+                     if (name == "all" or timing[0] == name) and not timing[2])
+        p50, p95, p99 = numpy.percentile(seconds, [50, 95, 99]) if len(
+            seconds) else (0.0, 0.0, 0.0)
+        results[name] = {
+            "requests": len(seconds),
+            "errors": errors,
+            "requests_per_second": len(seconds) / duration,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99)
+        }
+
+    return results
+
+
+# print results, and how they compare with an earlier run if given
+def report(results, previous=None):
+
+    print(f"{'route':<12}{'requests':>9}{'errors':>7}{'req/s':>9}"
+          f"{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}"
+          f"{'p95 change':>12}")
+    for name, result in results.items():
+        line = (f"{name:<12}{result['requests']:>9}{result['errors']:>7}"
+                f"{result['requests_per_second']:>9.1f}"
+                f"{result['p50'] * 1000:>10.2f}{result['p95'] * 1000:>10.2f}"
+                f"{result['p99'] * 1000:>10.2f}")
+        if previous is not None and name in previous and previous[name][
+                "p95"] > 0:
+            line += f"{result['p95'] / previous[name]['p95']:>11.2f}x"
+        print(line)
+
+
+# a free port on this machine
+def free_port():
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# start serve.py on a free port and wait until it is ready for queries
+def start_server(workers, threads):
+
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, "serve.py", "--builtin", "--bind",
+        "127.0.0.1:" + str(port), "--workers",
+        str(workers), "--threads",
+        str(threads)
+    ],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("server did not start")
+        try:
+            if http_request(("127.0.0.1", port), "GET", "/ready", None) == 200:
+                return server, ("127.0.0.1", port)
+        except OSError:
+            pass
+        time.sleep(0.2)
+
+    server.terminate()
+    raise SystemExit("server was not ready within 120 seconds")
+
+
+# this if statement stops the code below being executed when this file is imported
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Load test the web pages")
+    parser.add_argument("--concurrency",
+                        type=int,
+                        default=8,
+                        help="simulated users")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warm-up",
+                        type=float,
+                        default=2.0,
+                        help="seconds before timings are recorded")
+    parser.add_argument("--server",
+                        help="host:port of a running server "
+                        "(default: Flask's test client in this process)")
+    parser.add_argument("--start-server",
+                        action="store_true",
+                        help="start serve.py on a free port and test it")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=2,
+                        help="worker processes of the started server")
+    parser.add_argument("--threads",
+                        type=int,
+                        default=4,
+                        help="threads per worker of the started server")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare",
+                        help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)["results"]
+
+    server = None
+    if args.start_server:
+        server, address = start_server(args.workers, args.threads)
+        target = "serve.py " + str(args.workers) + "x" + str(args.threads)
+    elif args.server:
+        host, port = args.server.rsplit(":", 1)
+        address = (host, int(port))
+        target = args.server
+    else:
+        address = None
+        target = "test client"
+
+    try:
+        if address is None:
+            import main
+            main.prepare_models()
+
+            def make_sender():
+                client = main.app.test_client()
+                return lambda method, path, body: client_request(
+                    client, method, path, body)
+        else:
+
+            def make_sender():
+                return lambda method, path, body: http_request(
+                    address, method, path, body)
+
+        results = run_load_test(make_sender, args.concurrency, args.duration,
+                                args.warm_up)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print("Target: " + target + ", " + str(args.concurrency) + " users for " +
+          str(args.duration) + " seconds")
+    report(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(
+                {
+                    "environment": benchmark.environment(),
+                    "options": {
+                        "target": target,
+                        "concurrency": args.concurrency,
+                        "duration": args.duration,
+                        "warm_up": args.warm_up
+                    },
+                    "results": results
+                },
+                f,
+                indent=2)
+        print("Results written to " + args.output)
@@ -11,45 +11,32 @@
 
 # flask is used to allow Python application on server to communicate with
 # webpages on browser (including passing parameters both ways)
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, jsonify, Response
+
+# base64 and binascii for decoding images sent to the prediction API
+import base64
+import binascii
+# os for the files each cached page is made from
+import os
 
 import realtime_query
+# weights for all scenarios, loaded once and kept in memory
+import model_registry
+# timings, request counts and requests in flight (for the /metrics route)
+import metrics
+# micro-batching of concurrent queries (for its statistics)
+import inference_scheduler
+# pages rendered once and served from memory
+import page_cache
+# fine-tuning of the headline scenario from sketches labelled by users
+import fine_tuning
 
-# global constants
-
-# ANN configuration data
-configuration = {
-    "input_nodes": 784,  # number of nodes in input layer
-    "hidden_nodes": 200,  # number of nodes in hidden layer
-    "output_nodes": 10,  # number of nodes in output layer
-    "learning_rate": 0.1  # step size for gradient descent
-}
-
-# ANN training scenarios
-# "num_lines" = number of records (samples) to be read from MNIST training dataset
-# "num_epochs" = number of epochs (i.e. iterations through training datatset)
-scenarios = [{
-    "num_lines": 600,
-    "num_epochs": 1
-}, {
-    "num_lines": 6000,
-    "num_epochs": 1
-}, {
-    "num_lines": 60000,
-    "num_epochs": 1
-}, {
-    "num_lines": 60000,
-    "num_epochs": 5
-}]
-
-# confidence band thresholds
-high_threshold = 90.00
-medium_threshold = 60.00
-low_threshold = 20.00
-
-# pixel dimensions
-pixel_width = 28
-pixel_height = 28
+# global constants (see config.py) - the constants main.py used to define are
+# re-exported so main.configuration etc. keep working for existing callers;
+# settings are read (and changed at run time) in config, not through main
+import config
+from config import (configuration, scenarios, high_threshold,
+                    medium_threshold, low_threshold, pixel_width, pixel_height)
 
 # set up Flask app including where to find items in subdirectories
 app = Flask(__name__,
@@ -57,52 +44,317 @@ app = Flask(__name__,
             static_folder='static',
             template_folder='templates')
 
+# files in static/ (css, js, images) may be cached by browsers for
+# static_max_age seconds before they check back (see config.py)
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = config.static_max_age
+# templates are re-read when they change, so cached pages can be rendered
+# again from the new template (see page_cache.py)
+app.config["TEMPLATES_AUTO_RELOAD"] = True
+
+
+# route of the current request, as a label for metrics
+def route_label():
+
+    if request.url_rule is None:
+        return "unmatched"
+
+    return request.url_rule.rule
+
+
+# start timing every request and count it as in flight
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+    metrics.set_gauge("ann_requests_in_flight", amount=1, route=route_label())
+
+
+# record time taken by the request and its stages
+# (stages are also sent back to the browser in the Server-Timing header)
+@app.after_request
+def record_request_metrics(response):
+
+    spans, seconds = metrics.finish_request()
+    if seconds is not None:
+        metrics.observe("ann_request_seconds",
+                        seconds,
+                        route=route_label(),
+                        method=request.method)
+    if spans:
+        response.headers["Server-Timing"] = metrics.server_timing(spans)
+    metrics.increment("ann_requests_total",
+                      route=route_label(),
+                      method=request.method,
+                      status=response.status_code)
+
+    return response
+
+
+# request is no longer in flight (also runs if handling the request failed)
+@app.teardown_request
+def finish_request_metrics(error):
+    metrics.set_gauge("ann_requests_in_flight", amount=-1, route=route_label())
+
+
+# file a template is read from
+def template_file(template):
+    return os.path.join(app.root_path, app.template_folder, template)
+
 
 # Home route for Flask (corresponds to Home.html)
+# (rendered once and served from memory, see page_cache.py)
 @app.route("/Home")
 def Home():
     # any application code needed to support Home.html goes here
-    return render_template('Home.html')
+    return page_cache.page_response("Home",
+                                    lambda: render_template('Home.html'),
+                                    [template_file('Home.html')])
 
 
 # Info route for Flask (corresponds to Info.html)
 @app.route("/Info")
 def Info():
     # any application code needed to support Info.html goes here
-    return render_template('Info.html')
+    return page_cache.page_response("Info",
+                                    lambda: render_template('Info.html'),
+                                    [template_file('Info.html')])
 
 
 # Quiz route for Flask (corresponds to Quiz.html)
 @app.route("/Quiz")
 def Quiz():
     # any application code needed to support Info.html goes here
-    return render_template('Quiz.html')
+    return page_cache.page_response("Quiz",
+                                    lambda: render_template('Quiz.html'),
+                                    [template_file('Quiz.html')])
 
 
-# ANN route for Flask (corresponds to ANN.html)
-@app.route('/ANN', methods=['GET', 'POST'])
-def index():
+# ANN page before a digit is submitted: the same for everyone until the
+# template or the test scores change
+def render_ann_page():
 
     # initialise parameters that are going to be sent to browser
     parameters = realtime_query.initialise_parameters()
 
+    with metrics.span("render_template"):
+        return render_template('ANN.html',
+                               parameters=parameters,
+                               feedback=fine_tuning.is_active())
+
+
+# ANN route for Flask (corresponds to ANN.html)
+@app.route('/ANN', methods=['GET', 'POST'])
+def index():
+
     if request.method == 'POST':
         # get image captured by sketchpad at browser (as a string)
-        input_string = request.form.get('sketchpad_image')
+        with metrics.span("form_parsing"):
+            input_string = request.form.get('sketchpad_image')
         # process image (including submission to ANN) and get back
         # prediction/confidence data as "parameters"
         parameters = realtime_query.process_image(input_string)
         # return used by "POST" part of Flask to send parameters to ANN.html
-        return render_template('ANN.html', parameters=parameters)
+        with metrics.span("render_template"):
+            return render_template('ANN.html',
+                                   parameters=parameters,
+                                   feedback=fine_tuning.is_active())
+
+    # return used by "GET" part of flask (from memory, see page_cache.py)
+    return page_cache.page_response(
+        "ANN", render_ann_page,
+        [template_file('ANN.html'), realtime_query.test_scores_file])
+
+
+# sketchpad image sent to the prediction and feedback APIs, as one byte
+# (0 - 255) per pixel, either 224x224 or already compressed to 28x28 by the
+# browser, sent as:
+#   - the raw request body (Content-Type: application/octet-stream), or
+#   - JSON {"image": "<base64 encoded bytes>"}
+# reformatted for use by ANN (raises KeyError, TypeError, ValueError or
+# binascii.Error if it is not a valid image)
+def request_inputs_list():
+
+    with metrics.span("decode_image"):
+        if request.is_json:
+            image_bytes = base64.b64decode(request.get_json()["image"],
+                                           validate=True)
+        else:
+            image_bytes = request.get_data()
+        return realtime_query.decode_image_bytes(image_bytes)
+
+
+# prediction API for Flask (used by sketchpad.js to update ANN.html in place)
+# accepts the sketchpad image (see request_inputs_list) and
+# returns prediction/confidence data as JSON
+@app.route('/api/predict', methods=['POST'])
+def api_predict():
+
+    try:
+        inputs_list = request_inputs_list()
+    except (KeyError, TypeError, ValueError, binascii.Error) as error:
+        return jsonify(error="invalid image: " + str(error)), 400
+
+    # same prediction data as the ANN route, without the test scores or
+    # re-rendering the page (the answer is shared with the prediction cache,
+    # so is only read here)
+    with metrics.span("weights"):
+        models = model_registry.get_models()
+    predictions = realtime_query.cached_query_ann(inputs_list, models)
+
+    return jsonify(predictions=predictions["predictions"],
+                   confidences=predictions["confidences"],
+                   indices=predictions["indices"],
+                   values=predictions["values"],
+                   confidence_band=predictions["confidence_band"])
 
-    # return used by "GET" part of flask
-    return render_template('ANN.html', parameters=parameters)
+
+# feedback API for Flask (used by sketchpad.js when the user confirms or
+# corrects a prediction): the sketchpad image (see request_inputs_list) with
+# the digit actually drawn, given as ?label=<digit> or in the JSON as
+# {"image": ..., "label": <digit>}, is queued for fine-tuning the headline
+# scenario in the background (see fine_tuning.py) - 202 once queued
+@app.route('/api/feedback', methods=['POST'])
+def api_feedback():
+
+    if not fine_tuning.is_active():
+        return jsonify(error="online fine-tuning is switched off"), 404
+
+    try:
+        inputs_list = request_inputs_list()
+    except (KeyError, TypeError, ValueError, binascii.Error) as error:
+        return jsonify(error="invalid image: " + str(error)), 400
+
+    try:
+        if request.is_json:
+            label = request.get_json().get("label")
+        else:
+            label = request.args.get("label", type=int)
+        queued = fine_tuning.submit(inputs_list, label)
+    except ValueError as error:
+        return jsonify(error="invalid label: " + str(error)), 400
+
+    if not queued:
+        return jsonify(status="busy"), 503
+
+    return jsonify(status="queued"), 202
+
+
+# fine-tuning statistics (sketches received and trained on, weights published
+# and rolled back, held-out accuracy) as JSON
+@app.route('/api/fine_tuning_stats')
+def api_fine_tuning_stats():
+    return jsonify(fine_tuning.get_fine_tuning_stats())
+
+
+# prediction cache statistics (hits, misses, evictions, size) as JSON,
+# used to choose the prediction cache size
+@app.route('/api/cache_stats')
+def api_cache_stats():
+    return jsonify(realtime_query.get_prediction_cache_stats())
+
+
+# micro-batching statistics (batches, batch sizes, queue waits) as JSON,
+# used to choose the batch window and maximum batch size
+@app.route('/api/scheduler_stats')
+def api_scheduler_stats():
+    return jsonify(inference_scheduler.get_scheduler_stats())
+
+
+# metrics route for Flask: timings of each stage of handling requests,
+# request counts and requests in flight, in Prometheus text format
+@app.route('/metrics')
+def metrics_route():
+
+    # prediction cache statistics, as at the time of asking
+    for name, value in realtime_query.get_prediction_cache_stats().items():
+        metrics.set_gauge("ann_prediction_cache", value, statistic=name)
+
+    # micro-batching statistics, as at the time of asking
+    for name, value in inference_scheduler.get_scheduler_stats().items():
+        metrics.set_gauge("ann_scheduler", value, statistic=name)
+
+    # fine-tuning statistics, as at the time of asking (accuracies are not
+    # known until the first sketch has been trained on)
+    for name, value in fine_tuning.get_fine_tuning_stats().items():
+        if value is not None:
+            metrics.set_gauge("ann_fine_tuning", value, statistic=name)
+
+    return Response(metrics.prometheus_text(),
+                    mimetype="text/plain; version=0.0.4")
+
+
+# liveness route: the process is up and answering requests
+@app.route('/health')
+def health():
+    return jsonify(status="ok")
+
+
+# readiness route: only ready (200) once the weights for all scenarios are
+# loaded into memory, so a load balancer holds back queries until then (503)
+@app.route('/ready')
+def ready():
+
+    models = model_registry.loaded_models()
+    if models is None:
+        return jsonify(status="loading"), 503
+
+    return jsonify(status="ready",
+                   version=models["version"],
+                   precision=models["inference"]["precision"])
+
+
+# load weights for all scenarios into memory (before any queries), switching
+# to a reduced precision for queries if configured, provided it keeps its
+# accuracy on the MNIST test dataset, start online fine-tuning if configured
+# (swapping in the last fine-tuned weights, if fine-tuned from the same trained
+# weights) and render the cached pages
+# - used here and by serve.py
+def prepare_models():
+
+    models = model_registry.load_models()
+
+    # one query, so anything loaded on first use (e.g. scipy, see ANN.py) is
+    # ready before the first request - and before serve.py forks its workers
+    realtime_query.query_ann([0.01] * config.configuration["input_nodes"],
+                             models)
+
+    if config.inference_precision != "float64":
+        try:
+            realtime_query.activate_precision(config.inference_precision)
+            print("Answering queries in " + config.inference_precision)
+        except (OSError, ValueError) as error:
+            print("Keeping float64 precision: " + str(error))
+
+    # (only if the held-out sample it is checked against can be loaded)
+    if config.online_fine_tuning:
+        try:
+            fine_tuning.start()
+        except (OSError, ValueError) as error:
+            print("Online fine-tuning switched off: " + str(error))
+
+    if fine_tuning.is_active():
+        try:
+            if fine_tuning.restore_snapshot():
+                print("Restored fine-tuned weights from " +
+                      fine_tuning.snapshot_file)
+        except (OSError, ValueError, KeyError) as error:
+            print("Keeping trained weights: " + str(error))
+
+    # render the cached pages before the first request
+    with app.test_request_context():
+        for route in (Home, Info, Quiz, index):
+            route()
 
 
 # open browser and run Flask app
+# (development server - see serve.py for serving with several processes)
 if __name__ == '__main__':
     import webbrowser
 
+    # load weights once at startup and reload them in the background
+    # whenever train_and_test.py writes new weight files
+    prepare_models()
+    model_registry.start_watcher()
+
     # open web browser on localserver and use Home.html
     webbrowser.open_new('http://127.0.0.1:5000/Home')
 
@@ -0,0 +1,211 @@
+###################################################################################
+#
+#   In-process performance metrics
+#
+#   Keeps timings (as histograms), counters and gauges in memory and renders them
+#   in Prometheus text format for the /metrics route in main.py
+#
+#   Timings are recorded with "spans" around each stage of handling a request,
+#   e.g.
+#         with metrics.span("compress_image"):
+#             ...
+#   The spans of the current request are also kept (per thread), so the time
+#   taken by each stage can be sent back with the response (Server-Timing header)
+#
+#   train_and_test.py uses the same spans with log=True, which prints one
+#   structured line per phase instead of ad-hoc timing messages
+#
+#   called from:
+#         main.py
+#         realtime_query.py
+#         train_and_test.py
+#
+###################################################################################
+
+# contextlib for writing span as a "with" block
+import contextlib
+# threading for protecting metrics from concurrent requests and for keeping
+# the spans of the request being handled by each thread
+import threading
+# time for timing
+import time
+
+# upper bounds (seconds) of the histogram buckets
+buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+# type and description of each metric
+descriptions = {
+    "ann_stage_seconds":
+    ("histogram", "Time spent in each stage of handling a request"),
+    "ann_request_seconds": ("histogram", "Time taken to handle each request"),
+    "ann_requests_total": ("counter", "Requests handled"),
+    "ann_requests_in_flight": ("gauge", "Requests currently being handled"),
+    "ann_prediction_cache":
+    ("gauge", "Prediction cache hits, misses, evictions and size"),
+    "ann_scheduler":
+    ("gauge", "Micro-batching batches, batch sizes and queue waits"),
+    "ann_fine_tuning":
+    ("gauge", "Online fine-tuning sketches, checks and held-out accuracy"),
+    "ann_training_phase_seconds":
+    ("histogram", "Time taken by each phase of training and testing")
+}
+
+# metric values, keyed by (metric name, labels as sorted (name, value) pairs)
+_histograms = {}
+_counters = {}
+_gauges = {}
+_lock = threading.Lock()
+
+# spans of the request being handled by the current thread
+_request = threading.local()
+
+
+# labels as a hashable key
+def labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+# record a timing (seconds) in a histogram
+def observe(name, seconds, **labels):
+
+    key = (name, labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            _histograms[key] = histogram
+        for i in range(len(buckets)):
+            if seconds <= buckets[i]:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+# add to a counter
+def increment(name, amount=1, **labels):
+
+    key = (name, labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+# set a gauge, or change it by amount (e.g. +1 / -1 for requests in flight)
+def set_gauge(name, value=None, amount=0, **labels):
+
+    key = (name, labels_key(labels))
+    with _lock:
+        if value is not None:
+            _gauges[key] = value
+        else:
+            _gauges[key] = _gauges.get(key, 0) + amount
+
+
+# record the timing of a phase of training/testing and print it as
+# one structured line of key=value pairs
+def log_phase(phase, seconds, **fields):
+
+    observe("ann_training_phase_seconds", seconds, phase=phase)
+
+    line = "phase=" + phase + f" seconds={seconds:0.4f}"
+    for field, value in fields.items():
+        line += " " + field + "=" + str(value)
+    print(line)
+
+
+# time the block of code inside the "with", recording it as a stage of the
+# current request (ann_stage_seconds) - or, with log=True, as a phase of
+# training/testing which is also printed with any fields given (see log_phase)
+@contextlib.contextmanager
+def span(stage, log=False, **fields):
+
+    tic = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - tic
+        if log:
+            log_phase(stage, seconds, **fields)
+        else:
+            observe("ann_stage_seconds", seconds, stage=stage)
+            spans = getattr(_request, "spans", None)
+            if spans is not None:
+                spans.append((stage, seconds))
+
+
+# start collecting spans for a request handled by the current thread
+def start_request():
+
+    _request.spans = []
+    _request.start = time.perf_counter()
+
+
+# stop collecting spans for the current request, returning the spans and
+# the total time taken by the request
+def finish_request():
+
+    spans = getattr(_request, "spans", None) or []
+    start = getattr(_request, "start", None)
+    _request.spans = None
+    _request.start = None
+
+    if start is None:
+        return spans, None
+
+    return spans, time.perf_counter() - start
+
+
+# spans of a request in the Server-Timing header format
+def server_timing(spans):
+    return ", ".join(stage + ";dur=" + f"{seconds * 1000:0.3f}"
+                     for stage, seconds in spans)
+
+
+# labels in Prometheus text format, e.g. {stage="compress_image"}
+def format_labels(labels):
+
+    if not labels:
+        return ""
+
+    return "{" + ",".join(name + '="' + str(value).replace('"', '\\"') + '"'
+                          for name, value in labels) + "}"
+
+
+# all metrics in Prometheus text format
+def prometheus_text():
+
+    lines = []
+    with _lock:
+        names = sorted(
+            set(name for name, labels in _histograms) |
+            set(name for name, labels in _counters) |
+            set(name for name, labels in _gauges))
+        for name in names:
+            metric_type, description = descriptions.get(
+                name, ("untyped", name))
+            lines.append("# HELP " + name + " " + description)
+            lines.append("# TYPE " + name + " " + metric_type)
+
+            for (metric, labels), histogram in sorted(_histograms.items()):
+                if metric != name:
+                    continue
+                # bucket counts are kept cumulative, as Prometheus expects
+                for i in range(len(buckets)):
+                    lines.append(name + "_bucket" + format_labels(
+                        labels + (("le", str(buckets[i])), )) + " " +
+                                 str(histogram["buckets"][i]))
+                lines.append(name + "_bucket" +
+                             format_labels(labels + (("le", "+Inf"), )) +
+                             " " + str(histogram["count"]))
+                lines.append(name + "_sum" + format_labels(labels) + " " +
+                             repr(histogram["sum"]))
+                lines.append(name + "_count" + format_labels(labels) + " " +
+                             str(histogram["count"]))
+
+            for values in (_counters, _gauges):
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(name + format_labels(labels) + " " +
+                                     str(value))
+
+    return "\n".join(lines) + "\n"
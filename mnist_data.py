@@ -0,0 +1,118 @@
+###################################################################################
+#
+#   Loads the MNIST handwritten digit datasets
+#
+#   The CSV file (label followed by 784 pixel values 0 - 255 on each line) is
+#   parsed once, in chunks of lines, into:
+#         images - uint8 array with one row of 784 pixels per record
+#         labels - int array with the label (0 - 9) of each record
+#
+#   The arrays are cached next to the CSV file as .npy files, which later
+#   runs memory-map instead of parsing the CSV again
+#
+#   called from:
+#         train_and_test.py
+#
+#   files read from:
+#         mnist_train.csv / mnist_test.csv - MNIST datasets
+#
+#   files written to (cache):
+#         mnist_train_images.npy, mnist_train_labels.npy
+#         mnist_test_images.npy, mnist_test_labels.npy
+#
+###################################################################################
+
+# itertools.islice for reading the CSV file a chunk of lines at a time
+from itertools import islice
+# os for checking whether the cache is up to date
+import os
+# numpy for various mathematical actions (e.g. use of matrices)
+import numpy
+# writing the cache atomically
+import atomic_files
+
+# number of lines parsed at a time when reading a CSV file
+chunk_lines = 10000
+
+# values on each line of a CSV file (label followed by 28x28 pixels)
+values_per_record = 1 + 784
+
+
+# file names of the cached images and labels for a CSV file
+def cache_files(csv_file):
+
+    base_name = os.path.splitext(csv_file)[0]
+
+    return base_name + "_images.npy", base_name + "_labels.npy"
+
+
+# parse a CSV file in chunks of lines into images and labels arrays
+def parse_csv(csv_file):
+
+    chunks = []
+
+    with open(csv_file, 'r') as f:
+        while True:
+            lines = list(islice(f, chunk_lines))
+            if not lines:
+                break
+            # parse the chunk straight into bytes (all values are 0 - 255),
+            # treating the ends of lines as separators too
+            values = numpy.fromstring("".join(lines).replace('\n', ','),
+                                      dtype=numpy.uint8,
+                                      sep=',')
+            chunks.append(values.reshape(-1, values_per_record))
+
+    records = numpy.concatenate(chunks) if chunks else numpy.zeros(
+        (0, values_per_record), dtype=numpy.uint8)
+
+    images = numpy.ascontiguousarray(records[:, 1:])
+    labels = records[:, 0].astype(numpy.int64)
+
+    return images, labels
+
+
+# save an array atomically, so that a reader never sees a half-written cache
+def save_array(file_name, array):
+    atomic_files.write_atomically(file_name, lambda f: numpy.save(f, array))
+
+
+# true if both cache files exist and are newer than the CSV file
+def cache_is_current(csv_file):
+
+    images_file, labels_file = cache_files(csv_file)
+    try:
+        csv_time = os.stat(csv_file).st_mtime_ns
+    except FileNotFoundError:
+        # without the CSV file, any cache there is will do
+        csv_time = 0
+
+    for file_name in (images_file, labels_file):
+        if not os.path.exists(file_name) or os.stat(
+                file_name).st_mtime_ns < csv_time:
+            return False
+
+    return True
+
+
+# load images and labels for a dataset, from the cache if it is up to date,
+# otherwise by parsing the CSV file (and then caching the result)
+def load_dataset(csv_file):
+
+    images_file, labels_file = cache_files(csv_file)
+
+    if not cache_is_current(csv_file):
+        images, labels = parse_csv(csv_file)
+        save_array(images_file, images)
+        save_array(labels_file, labels)
+
+    images = numpy.load(images_file, mmap_mode='r')
+    labels = numpy.load(labels_file, mmap_mode='r')
+
+    return images, labels
+
+
+# scale and shift pixel values for use by ANN (one row per record):
+# normalise (so in range 0 - 1) and shift the inputs (ANN works best if avoid 0)
+def scale_inputs(images):
+    return (images / 255.0 * 0.99) + 0.01
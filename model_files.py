@@ -0,0 +1,186 @@
+###################################################################################
+#
+#   Binary model files - one bundle per scenario holding the trained weights
+#
+#   Each scenario is saved as model_<i>.npz, an uncompressed numpy archive with:
+#         wih - weights used between input and hidden layers
+#         who - weights used between hidden and output layers
+#         metadata - layer shapes, scenario and ANN configuration used (as JSON)
+#
+#   As the archive is uncompressed, the weights can be memory-mapped straight
+#   from the file (no parsing), so loading takes milliseconds and server
+#   processes share the same pages through the operating system's page cache
+#
+#   The weights_*.csv files remain the source of truth: each model file records
+#   the size and modification time of the CSV files it was made from, and is
+#   made again from them (see model_registry.py) once they have changed
+#
+#   Running this file converts the existing weights_*.csv files to model_*.npz:
+#         python model_files.py
+#
+#   called from:
+#         model_registry.py
+#         train_and_test.py
+#
+###################################################################################
+
+# json for the metadata stored alongside the weights
+import json
+# os for checking the CSV weights a model file was made from
+import os
+# zipfile for finding where each array is stored inside the archive
+import zipfile
+# numpy for various mathematical actions (e.g. use of matrices)
+import numpy
+# loadtxt is used to read from file
+from numpy import loadtxt
+# writing model files atomically
+import atomic_files
+
+
+# file name of the binary model for scenario i
+def model_file(i):
+    return "model_" + str(i) + ".npz"
+
+
+# file names of the CSV weights for scenario i
+def weight_files(i):
+
+    wih_file = "weights_wih_" + str(i) + ".csv"
+    who_file = "weights_who_" + str(i) + ".csv"
+
+    return wih_file, who_file
+
+
+# size and modification time of the CSV weights for scenario i
+# (None for a file that does not exist)
+def csv_signature(i):
+
+    signature = []
+    for file_name in weight_files(i):
+        try:
+            status = os.stat(file_name)
+            signature.append([file_name, status.st_size, status.st_mtime_ns])
+        except FileNotFoundError:
+            signature.append([file_name, None, None])
+
+    return signature
+
+
+# save weights (plus metadata) for a scenario as a binary model file
+def save_model(file_name, wih, who, metadata):
+
+    metadata = dict(metadata)
+    metadata["wih_shape"] = list(wih.shape)
+    metadata["who_shape"] = list(who.shape)
+
+    # written atomically, so a reader never sees a half-written file (and
+    # existing memory maps keep the old file)
+    atomic_files.write_atomically(
+        file_name, lambda f: numpy.savez(
+            f,
+            wih=numpy.asarray(wih, dtype=numpy.float64),
+            who=numpy.asarray(who, dtype=numpy.float64),
+            metadata=numpy.array(json.dumps(metadata))))
+
+
+# memory-map one array stored (uncompressed) inside a numpy archive
+def map_member(file_name, archive, name):
+
+    info = archive.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(file_name + " is compressed, so cannot be mapped")
+
+    with open(file_name, 'rb') as f:
+        # skip the zip "local file header" to reach the .npy data
+        f.seek(info.header_offset)
+        header = f.read(30)
+        name_length = int.from_bytes(header[26:28], "little")
+        extra_length = int.from_bytes(header[28:30], "little")
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+
+        # read the .npy header to find the shape and type of the array
+        npy_format = numpy.lib.format
+        if npy_format.read_magic(f) == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    return numpy.memmap(file_name,
+                        dtype=dtype,
+                        mode='r',
+                        offset=offset,
+                        shape=shape,
+                        order='F' if fortran_order else 'C')
+
+
+# load weights and metadata for a scenario from a binary model file
+# (weights are memory-mapped and read-only)
+def load_model(file_name):
+
+    with zipfile.ZipFile(file_name) as archive:
+        with archive.open("metadata.npy") as f:
+            metadata = json.loads(str(numpy.lib.format.read_array(f)))
+        wih = map_member(file_name, archive, "wih")
+        who = map_member(file_name, archive, "who")
+
+    if list(wih.shape) != metadata["wih_shape"] or list(
+            who.shape) != metadata["who_shape"]:
+        raise ValueError(file_name + " does not match its metadata")
+
+    return wih, who, metadata
+
+
+# save weights for scenario i as its binary model file, recording the CSV
+# weights they were made from (call once the CSV files have been written)
+def save_scenario_model(i, wih, who):
+
+    # imported here, as only scenario models need it
+    import config
+
+    metadata = {
+        "scenario": i,
+        "configuration": config.configuration,
+        "training": config.scenarios[i],
+        "csv_signature": csv_signature(i)
+    }
+    save_model(model_file(i), wih, who, metadata)
+
+
+# True if the binary model file for scenario i exists and was made from the
+# CSV weights as they are now (or there are no CSV weights to make it from)
+def model_is_current(i):
+
+    if not os.path.exists(model_file(i)):
+        return False
+
+    signature = csv_signature(i)
+    if all(size is None for file_name, size, mtime in signature):
+        return True
+
+    with zipfile.ZipFile(model_file(i)) as archive:
+        with archive.open("metadata.npy") as f:
+            metadata = json.loads(str(numpy.lib.format.read_array(f)))
+
+    return metadata.get("csv_signature") == signature
+
+
+# convert the weights_*.csv files for every scenario to binary model files
+def convert_csv_weights():
+
+    # imported here, as only the converter needs it
+    import config
+
+    for i in range(len(config.scenarios)):
+        wih_file, who_file = weight_files(i)
+        wih = loadtxt(wih_file, delimiter=',')
+        who = loadtxt(who_file, delimiter=',')
+        save_scenario_model(i, wih, who)
+        print("Converted " + wih_file + " and " + who_file + " to " +
+              model_file(i))
+
+
+# this if statement stops the code below being executed when this file is imported
+if __name__ == "__main__":
+    convert_csv_weights()
@@ -0,0 +1,360 @@
+###################################################################################
+#
+#   Process-wide registry of the trained weights for all scenarios
+#
+#   Weights are read from file once and then kept in memory, so that queries
+#   to the Artificial Neural Network (ANN) do not re-read the weight files on
+#   every request.
+#
+#   A background watcher notices when train_and_test.py writes new weight files,
+#   reloads them and swaps them in as a whole, so a query always sees a complete
+#   and consistent set of weights (never a mix of old and half-written new ones)
+#
+#   Weights fine-tuned while serving (see fine_tuning.py) are swapped in the
+#   same way by publish_weights, so queries never wait on training
+#
+#   New weights answer queries in float64 until they have passed the accuracy
+#   check given to set_precision in the reduced precision (see apply_precision)
+#
+#   called from:
+#         main.py
+#         realtime_query.py
+#         fine_tuning.py
+#
+#   files read from:
+#         model_0.npz ... model_3.npz - binary weights for each scenario
+#                                       (preferred while they match the CSV
+#                                       files, see model_files.py)
+#         weights_wih_0.csv ... 3.csv - weights for input to hidden layers
+#         weights_who_0.csv ... 3.csv - weights for hidden to output layers
+#
+#   files written to:
+#         model_0.npz ... model_3.npz - made from the CSV files when missing or
+#                                       older than them
+#
+###################################################################################
+
+# os for checking modification times and sizes of weight files
+import os
+# threading for the background watcher and for serialising reloads
+import threading
+# numpy for various mathematical actions (e.g. use of matrices)
+import numpy
+# loadtxt is used to read from file
+from numpy import loadtxt
+# access to ANN.py needed for preparing weights for queries
+import ANN
+# binary (memory-mappable) model files
+import model_files
+# global constants (see config.py)
+import config
+
+# number of scenarios for which weights are held (see scenarios in config.py)
+num_scenarios = len(config.scenarios)
+
+# seconds between checks for new weight files
+watch_interval = 2.0
+
+# precision used to answer queries once checked (see ANN.inference_weights
+# and set_precision), and the check: function(models, precision) raising
+# ValueError if the weights are not accurate enough in that precision
+_precision = "float64"
+_precision_check = None
+
+# models currently in use - replaced as a whole (never modified in place)
+# so readers always see one complete set of weights
+_models = None
+
+# serialises loads so two threads never parse the same files at once
+_load_lock = threading.Lock()
+
+# background watcher thread (None until start_watcher is called)
+_watcher = None
+_stop_watcher = threading.Event()
+
+
+# modification time and size of every weight file, used to detect new weights
+def files_signature():
+
+    signature = []
+    for i in range(num_scenarios):
+        for file_name in ((model_files.model_file(i), ) +
+                          model_files.weight_files(i)):
+            try:
+                status = os.stat(file_name)
+                signature.append((file_name, status.st_mtime_ns,
+                                  status.st_size))
+            except FileNotFoundError:
+                signature.append((file_name, None, None))
+
+    return tuple(signature)
+
+
+# read weights for all scenarios from file and check they fit together
+def read_models(signature):
+
+    wih_list = []
+    who_list = []
+    metadata_list = []
+    remade = False
+
+    for i in range(num_scenarios):
+        # binary model file is memory-mapped without parsing;
+        # fall back to the CSV files where it is missing or older than them
+        if model_files.model_is_current(i):
+            wih, who, metadata = model_files.load_model(
+                model_files.model_file(i))
+        else:
+            wih_file, who_file = model_files.weight_files(i)
+            wih = loadtxt(wih_file, delimiter=',')
+            who = loadtxt(who_file, delimiter=',')
+            metadata = None
+            # make the model file again, so later loads need not parse them
+            try:
+                model_files.save_scenario_model(i, wih, who)
+                remade = True
+            except OSError as error:
+                print("Could not write " + model_files.model_file(i) + ": " +
+                      str(error))
+
+        # a partially written file gives a short or ragged matrix, so check
+        # the shapes chain together (hidden nodes shared by wih and who)
+        # and match the other scenarios (so they can be stacked)
+        if wih.ndim != 2 or who.ndim != 2 or who.shape[1] != wih.shape[0] or (
+                wih_list and (wih.shape != wih_list[0].shape
+                              or who.shape != who_list[0].shape)):
+            raise ValueError("weights for scenario " + str(i) +
+                             " have inconsistent shapes " + str(wih.shape) +
+                             " and " + str(who.shape))
+
+        # weights are shared between threads, so protect them from changes
+        wih.setflags(write=False)
+        who.setflags(write=False)
+
+        wih_list.append(wih)
+        who_list.append(who)
+        metadata_list.append(metadata)
+
+    # the model files made above are part of what was loaded, so the watcher
+    # does not load them again
+    if remade:
+        signature = files_signature()
+
+    version = 1 if _models is None else _models["version"] + 1
+
+    models = {
+        "version": version,
+        "signature": signature,
+        "wih": wih_list,
+        "who": who_list,
+        "metadata": metadata_list,
+        # (float64 until checked in a reduced precision, see apply_precision)
+        "inference": stacked_inference_weights(wih_list, who_list, "float64")
+    }
+
+    return models
+
+
+# stack weights of all scenarios into single (scenarios, hidden, input) and
+# (scenarios, output, hidden) arrays, so one query runs every scenario
+# in a single batched forward pass, in the given precision
+def stacked_inference_weights(wih_list, who_list, precision):
+
+    weights = ANN.inference_weights(numpy.stack(wih_list),
+                                    numpy.stack(who_list), precision)
+    # weights are shared between threads, so protect them from changes
+    weights["wih"].setflags(write=False)
+    weights["who"].setflags(write=False)
+
+    return weights
+
+
+# copy of models answering queries in the given precision
+# (a new version, as answers in a new precision can differ slightly)
+def models_in_precision(models, precision):
+
+    models = dict(models)
+    models["version"] = models["version"] + 1
+    models["inference"] = stacked_inference_weights(models["wih"],
+                                                    models["who"], precision)
+
+    return models
+
+
+# switch the precision used to answer queries to precision (see
+# ANN.inference_weights), for checked_models - which have passed check
+# (see realtime_query.activate_precision) - and for any weights swapped in
+# later once they pass check too
+def set_precision(precision, check, checked_models):
+    global _models, _precision, _precision_check
+
+    with _load_lock:
+        _precision = precision
+        _precision_check = check
+        if _models is checked_models:
+            _models = models_in_precision(checked_models, precision)
+
+    # weights swapped in while checked_models were being checked
+    return apply_precision()
+
+
+# answer queries with the weights in use in the precision chosen by
+# set_precision, once they pass its check (otherwise they stay in float64
+# until other weights are swapped in) - called by whoever swaps in new
+# weights; returns the weights in use
+def apply_precision():
+    global _models
+
+    models = get_models()
+    precision, check = _precision, _precision_check
+    if models["inference"]["precision"] == precision:
+        return models
+
+    if check is not None:
+        try:
+            check(models, precision)
+        except (OSError, ValueError) as error:
+            print("Answering queries in float64: " + str(error))
+            return models
+
+    new_models = models_in_precision(models, precision)
+    with _load_lock:
+        # other weights swapped in meanwhile are left to whoever swapped them in
+        if _models is not models or _precision != precision:
+            return _models
+        _models = new_models
+
+    return new_models
+
+
+# swap in new weights for scenario i (e.g. fine-tuned, see fine_tuning.py) for
+# all subsequent queries, keeping those of the other scenarios - only if the
+# weights in use for scenario i are still expected_wih (so weights reloaded
+# in the meantime are never overwritten), otherwise returns None; wih and
+# who are shared with queries from then on, so are made read-only
+def publish_weights(i, wih, who, expected_wih):
+    global _models
+
+    with _load_lock:
+        models = get_models_unlocked()
+        if models["wih"][i] is not expected_wih:
+            return None
+
+        wih.setflags(write=False)
+        who.setflags(write=False)
+        wih_list = list(models["wih"])
+        who_list = list(models["who"])
+        wih_list[i] = wih
+        who_list[i] = who
+
+        # a new version, so earlier answers are no longer used
+        models = dict(models)
+        models["version"] = models["version"] + 1
+        models["wih"] = wih_list
+        models["who"] = who_list
+        # (float64 until checked in a reduced precision, see apply_precision)
+        models["inference"] = stacked_inference_weights(
+            wih_list, who_list, "float64")
+        # a single assignment, so readers get either the old or new set
+        _models = models
+
+    return models
+
+
+# (re)load weights from file and swap them in for all subsequent queries
+def load_models():
+
+    with _load_lock:
+        return load_models_unlocked()
+
+
+# (re)load weights, for callers already holding _load_lock
+def load_models_unlocked():
+    global _models
+
+    signature = files_signature()
+    # another thread may have loaded the same files while we waited
+    if _models is not None and _models["signature"] == signature:
+        return _models
+    models = read_models(signature)
+    # a single assignment, so readers get either the old or new set
+    _models = models
+
+    return models
+
+
+# weights in use, loading them first if needed (caller holds _load_lock)
+def get_models_unlocked():
+
+    if _models is None:
+        return load_models_unlocked()
+
+    return _models
+
+
+# weights for use by a query (loaded on first use)
+def get_models():
+
+    models = _models
+    if models is None:
+        models = load_models()
+
+    return models
+
+
+# weights in use, or None if they have not been loaded yet (never loads them)
+def loaded_models():
+    return _models
+
+
+# background loop checking for new weight files
+def watch(interval):
+
+    last_seen = files_signature()
+    # files that could not be loaded (only retried once they change again)
+    failed = None
+
+    while not _stop_watcher.wait(interval):
+        signature = files_signature()
+        if signature != last_seen:
+            # files are still changing (e.g. being written) - wait until
+            # they have been stable for a whole interval before reloading
+            last_seen = signature
+            continue
+        if signature == failed or (_models is not None
+                                   and signature == _models["signature"]):
+            continue
+        try:
+            load_models()
+            print("Reloaded weights (version " + str(_models["version"]) +
+                  ")")
+            apply_precision()
+        except (OSError, ValueError) as error:
+            # keep serving the current weights until the files change again
+            failed = signature
+            print("Could not reload weights: " + str(error))
+
+
+# start background thread that reloads weights when the files change
+def start_watcher(interval=watch_interval):
+    global _watcher
+
+    if _watcher is not None and _watcher.is_alive():
+        return _watcher
+
+    _stop_watcher.clear()
+    _watcher = threading.Thread(target=watch,
+                                args=(interval, ),
+                                name="model-registry-watcher",
+                                daemon=True)
+    _watcher.start()
+
+    return _watcher
+
+
+# stop the background watcher (e.g. at shutdown)
+def stop_watcher():
+
+    _stop_watcher.set()
+    if _watcher is not None:
+        _watcher.join()
@@ -0,0 +1,119 @@
+###################################################################################
+#
+#   In-memory cache of rendered pages
+#
+#   Pages that are the same for every visitor (Home, Info, Quiz and the ANN page
+#   before a digit is submitted) are rendered once and then served from memory,
+#   with an ETag and Last-Modified date so that a browser asking again with
+#   If-None-Match / If-Modified-Since is answered "304 Not Modified" without
+#   the page being sent again
+#
+#   A page is rendered again when any file it is made from changes (its template,
+#   or e.g. test_scores.csv for the ANN page) - checked at most once every
+#   check_interval seconds for each page, so most requests do no file access
+#
+#   called from:
+#         main.py
+#
+###################################################################################
+
+# hashlib for the ETag of each page
+import hashlib
+# os for modification times of the files each page is made from
+import os
+# threading for protecting the cache from concurrent requests
+import threading
+# time for limiting how often files are checked for changes
+import time
+# flask for responses and answering conditional requests
+from flask import Response, request
+
+# seconds between checks that the files a page is made from have not changed
+check_interval = 1.0
+
+# rendered pages, by name:
+# {"body", "etag", "last_modified", "signature", "checked"}
+_pages = {}
+_lock = threading.Lock()
+
+
+# modification time and size of each file a page is made from
+def files_signature(files):
+
+    signature = []
+    for file_name in files:
+        try:
+            status = os.stat(file_name)
+            signature.append((file_name, status.st_mtime, status.st_size))
+        except FileNotFoundError:
+            signature.append((file_name, None, None))
+
+    return tuple(signature)
+
+
+# render a page and work out its ETag and Last-Modified date
+def render_page(render, signature):
+
+    body = render()
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    modified_times = [mtime for name, mtime, size in signature if mtime]
+
+    return {
+        "body": body,
+        "etag": hashlib.blake2b(body, digest_size=16).hexdigest(),
+        "last_modified": max(modified_times) if modified_times else time.time(),
+        "signature": signature,
+        "checked": time.monotonic()
+    }
+
+
+# page from the cache, rendering it first if it is not cached yet or any of
+# the files it is made from have changed
+def get_page(name, render, files):
+    #
+    #  name = name of the page in the cache
+    #  render = function returning the page as rendered (str or bytes)
+    #  files = files the page is made from (template, data files)
+    #
+    page = _pages.get(name)
+    if page is not None and time.monotonic() - page["checked"] < check_interval:
+        return page
+
+    signature = files_signature(files)
+    if page is not None and page["signature"] == signature:
+        page["checked"] = time.monotonic()
+        return page
+
+    with _lock:
+        # another request may have rendered the same page while we waited
+        page = _pages.get(name)
+        if page is None or page["signature"] != signature:
+            page = render_page(render, signature)
+            # a single assignment, so readers get either the old or new page
+            _pages[name] = page
+
+    return page
+
+
+# response for a cached page, answering conditional requests with
+# "304 Not Modified" - browsers check back each time (no-cache), which costs
+# only the check while the page has not changed
+def page_response(name, render, files):
+
+    page = get_page(name, render, files)
+
+    response = Response(page["body"], mimetype="text/html")
+    response.set_etag(page["etag"])
+    response.last_modified = page["last_modified"]
+    response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
+
+
+# forget every cached page (they are rendered again when next asked for)
+def clear():
+
+    with _lock:
+        _pages.clear()
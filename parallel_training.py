@@ -0,0 +1,236 @@
+###################################################################################
+#
+#   Multi-core (data-parallel) training of the artificial neural network
+#
+#   An opt-in alternative to training() in train_and_test.py: the training
+#   records are split across a pool of worker processes, which all update the
+#   same weights held in shared memory without locking ("Hogwild" style).
+#   Updates from different workers can overlap, so the result differs a little
+#   from single-process training - the report printed at the end shows the
+#   speed-up and the test accuracy against the single-process baseline so the
+#   trade-off can be judged
+#
+#   run as:
+#         python parallel_training.py --scenario 3 --workers 8 --baseline
+#   (add --save to save the weights from parallel training for the scenario)
+#
+#   calls:
+#         train_and_test.py
+#         mnist_data.py
+#         worker_pools.py
+#
+###################################################################################
+
+# argparse for the command line options
+import argparse
+# multiprocessing for the weights shared by the worker processes
+from multiprocessing import shared_memory
+# os for the number of cores
+import os
+# time for measuring training speed
+import time
+# numpy for various mathematical actions (e.g. use of matrices)
+import numpy
+# global constants (see config.py)
+import config
+# MNIST datasets, parsed once and cached (workers memory-map the same cache)
+import mnist_data
+# training step, evaluation and saving of weights
+import train_and_test
+# pools of worker processes using one core each
+from worker_pools import single_threaded_workers
+
+# state of each worker process, set up once by start_worker
+_worker = {}
+
+
+# weights held in a block of shared memory, viewed as numpy arrays
+def shared_weights(memory, wih_shape, who_shape):
+
+    wih_size = wih_shape[0] * wih_shape[1]
+    weights = numpy.ndarray((wih_size + who_shape[0] * who_shape[1], ),
+                            dtype=numpy.float64,
+                            buffer=memory.buf)
+    wih = weights[:wih_size].reshape(wih_shape)
+    who = weights[wih_size:].reshape(who_shape)
+
+    return wih, who
+
+
+# set up a worker process: attach to the shared weights and training data,
+# then wait at the barrier until every worker is ready
+def start_worker(memory_name, wih_shape, who_shape, configuration, num_lines,
+                 ready):
+
+    # the parent process owns (and removes) the shared memory
+    memory = shared_memory.SharedMemory(name=memory_name)
+
+    config.configuration.update(configuration)
+    images, labels = mnist_data.load_dataset("mnist_train.csv")
+
+    _worker["memory"] = memory
+    _worker["weights"] = shared_weights(memory, wih_shape, who_shape)
+    _worker["images"] = images[0:num_lines]
+    _worker["labels"] = labels[0:num_lines]
+
+    ready.wait()
+
+
+# train on one worker's share of the records for one epoch,
+# updating the shared weights in place
+def train_shard(shard):
+    #
+    #  shard = (worker index, number of workers) - the worker takes every
+    #          "number of workers"th record, starting at its index
+    #
+
+    index, workers = shard
+    wih, who = _worker["weights"]
+    batch_size = config.configuration["batch_size"]
+    records = numpy.arange(index, len(_worker["labels"]), workers)
+
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        train_and_test.training_step(_worker["images"][batch],
+                                     _worker["labels"][batch], wih, who)
+
+    return len(records)
+
+
+# train scenario i across a pool of worker processes sharing the weights
+def parallel_training(i, wih_init, who_init, workers):
+    #
+    #  i = scenario index
+    #  wih_init = initial weights used between input and hidden layers
+    #  who_init = initial weights used between hidden and output layers
+    #  workers = number of worker processes
+    #
+
+    num_lines = config.scenarios[i]["num_lines"]
+    num_epochs = config.scenarios[i]["num_epochs"]
+
+    # make sure the cache of the training data exists before workers map it
+    train_and_test.load_training_data(num_lines)
+
+    memory = shared_memory.SharedMemory(create=True,
+                                        size=(wih_init.size + who_init.size) *
+                                        8)
+    try:
+        wih, who = shared_weights(memory, wih_init.shape, who_init.shape)
+        wih[:] = wih_init
+        who[:] = who_init
+
+        with single_threaded_workers() as context:
+            ready = context.Barrier(workers + 1)
+            with context.Pool(workers,
+                              initializer=start_worker,
+                              initargs=(memory.name, wih_init.shape,
+                                        who_init.shape, config.configuration,
+                                        num_lines, ready)) as pool:
+                # time training only (as the baseline), from when every
+                # worker has started and loaded its data
+                ready.wait()
+                tic = time.perf_counter()
+                samples = 0
+                for epoch in range(num_epochs):
+                    samples += sum(
+                        pool.map(train_shard, [(index, workers)
+                                               for index in range(workers)]))
+                toc = time.perf_counter()
+
+        wih = wih.copy()
+        who = who.copy()
+    finally:
+        memory.close()
+        memory.unlink()
+
+    return wih, who, samples / (toc - tic)
+
+
+# train scenario i in this process only (as training() in train_and_test.py,
+# without saving weights) to give a baseline for parallel training
+def baseline_training(i, wih_init, who_init):
+
+    images, labels = train_and_test.load_training_data(
+        config.scenarios[i]["num_lines"])
+    batch_size = config.configuration["batch_size"]
+
+    wih = wih_init.copy()
+    who = who_init.copy()
+
+    tic = time.perf_counter()
+    for epoch in range(config.scenarios[i]["num_epochs"]):
+        for start in range(0, len(labels), batch_size):
+            train_and_test.training_step(images[start:start + batch_size],
+                                         labels[start:start + batch_size],
+                                         wih, who)
+    toc = time.perf_counter()
+
+    samples = len(labels) * config.scenarios[i]["num_epochs"]
+
+    return wih, who, samples / (toc - tic)
+
+
+# replace the test score of scenario i in test_scores.csv (shown on the ANN
+# page next to the weights it belongs to), keeping those of other scenarios
+def save_test_score(i, test_score):
+
+    try:
+        with open("test_scores.csv", 'r') as f:
+            test_scores = [line.strip() for line in f]
+    except FileNotFoundError:
+        test_scores = []
+    test_scores += ["-"] * (len(config.scenarios) - len(test_scores))
+    test_scores[i] = test_score
+
+    train_and_test.save_test_scores(test_scores)
+
+
+# this if statement stops the code below being executed when this file is imported
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Train a scenario across several processes")
+    parser.add_argument("--scenario", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--baseline",
+                        action="store_true",
+                        help="also train in a single process and compare")
+    parser.add_argument("--save",
+                        action="store_true",
+                        help="save the weights from parallel training")
+    args = parser.parse_args()
+
+    wih_init, who_init = train_and_test.initialise_for_train_and_test()
+    test_data = train_and_test.load_test_data()
+
+    results = []
+    wih, who, speed = parallel_training(args.scenario, wih_init, who_init,
+                                        args.workers)
+    accuracy = train_and_test.evaluation(test_data, wih, who)["accuracy"]
+    results.append((str(args.workers) + " workers", speed, accuracy))
+
+    if args.save:
+        train_and_test.save_weights(wih, who,
+                                    "weights_wih_" + str(args.scenario) +
+                                    ".csv",
+                                    "weights_who_" + str(args.scenario) +
+                                    ".csv", args.scenario)
+        # the score shown for the scenario must be that of the new weights
+        save_test_score(args.scenario,
+                        train_and_test.testing(test_data, wih, who,
+                                               args.scenario))
+
+    if args.baseline:
+        wih, who, speed = baseline_training(args.scenario, wih_init,
+                                            who_init)
+        accuracy = train_and_test.evaluation(test_data, wih,
+                                             who)["accuracy"]
+        results.append(("single process", speed, accuracy))
+
+    print(f"{'mode':<16}{'samples/s':>12}{'accuracy':>10}")
+    for mode, speed, accuracy in results:
+        print(f"{mode:<16}{speed:>12.0f}{accuracy * 100:>9.2f}%")
+    if args.baseline:
+        print(f"speed-up {results[0][1] / results[1][1]:0.2f}x, accuracy "
+              f"change {(results[0][2] - results[1][2]) * 100:+0.2f} points")
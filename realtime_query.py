@@ -7,31 +7,56 @@
 #
 #   called from:
 #         ANN route in main.py
+#         batch_score.py (compression of sketchpad images in bulk)
 #
 #   calls:
 #         ANN.py
+#         model_registry.py (weights for each scenario, held in memory)
+#         inference_scheduler.py (runs concurrent queries in batches)
 #
 #   files read from:
-#         weights_wih_0.csv - weights for input to hidden layers in scenario 0
-#         weights_wih_1.csv - weights for input to hidden layers in scenario 1
-#         weights_wih_2.csv - weights for input to hidden layers in scenario 2
-#         weights_wih_3.csv - weights for input to hidden layers in scenario 3
-#         weights_who_0.csv - weights for hidden to output layers in scenario 0
-#         weights_who_1.csv - weights for hidden to output layers in scenario 1
-#         weights_who_2.csv - weights for hidden to output layers in scenario 2
-#         weights_who_3.csv - weights for hidden to output layers in scenario 3
 #         test_scores.csv - accuracy for each scenario based on MNIST test dataset
+#         mnist_test.csv - MNIST test dataset (only to check a reduced precision)
 #
 ###################################################################################
 
+# hashlib and collections for the cache of recent predictions
+import hashlib
+from collections import OrderedDict
+# os for noticing when the test scores file changes
+import os
+# threading for protecting the cache from concurrent requests
+import threading
+# time for timing batched queries
+import time
 # numpy for various mathematical actions (e.g. use of matrices)
 import numpy
-# loadtxt is used to read from file
-from numpy import loadtxt
 # access to ANN.py needed
 import ANN
-# access to main.py needed for global constants
-import main
+# runs concurrent queries together in batches
+import inference_scheduler
+# weights for all scenarios, loaded once and kept in memory
+import model_registry
+# MNIST test dataset, used to check accuracy in reduced precision
+import mnist_data
+# timings of each stage of processing a query
+import metrics
+# global constants (see config.py)
+import config
+
+# cache of recent predictions (least recently used first), for the
+# weights version given by _prediction_cache_version
+_prediction_cache = OrderedDict()
+_prediction_cache_version = None
+_prediction_cache_lock = threading.Lock()
+prediction_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+# accuracy of each scenario on the MNIST test dataset (see train_and_test.py)
+test_scores_file = "test_scores.csv"
+
+# test scores last read, with the modification time and size of the file
+# when they were read: (signature, test_scores)
+_test_scores = (None, None)
 
 
 # utility function to load test scores
@@ -39,17 +64,31 @@ import main
 def load_test_scores():
 
     # load the MNIST test data file into a list
-    test_scores_file = open("test_scores.csv", 'r')
-    test_scores = test_scores_file.readlines()
-    test_scores_file.close()
+    with open(test_scores_file, 'r') as f:
+        test_scores = f.readlines()
 
     return test_scores
 
 
+# test scores as last read from file, read again only once the file changes
+# (so queries need not read it every time)
+def cached_test_scores():
+    global _test_scores
+
+    status = os.stat(test_scores_file)
+    signature = (status.st_mtime_ns, status.st_size)
+
+    # (a single assignment, so other threads see the old or new pair)
+    if _test_scores[0] != signature:
+        _test_scores = (signature, load_test_scores())
+
+    return list(_test_scores[1])
+
+
 # initialisation
 def initialise_parameters():
 
-    test_scores = load_test_scores()
+    test_scores = cached_test_scores()
 
     parameters = {
         "predictions": ['-', '-', '-', '-'],
@@ -63,103 +102,324 @@ def initialise_parameters():
     return parameters
 
 
+# compress sketchpad image (darkness readings 0 - 255, one byte per pixel)
+# from 224x224 to 28x28, then reformat for use by ANN
+def compress_pixels(pixels):
+
+    num_pixels = config.sketchpad_width * config.sketchpad_height
+    if pixels.size != num_pixels:
+        raise ValueError("expected " + str(num_pixels) +
+                         " pixels from sketchpad, got " + str(pixels.size))
+
+    return compress_sketches(pixels.reshape(1, num_pixels))[0]
+
+
+# compress several sketchpad images at once (one row of 224x224 darkness
+# readings per image) to 28x28, then reformat for use by ANN (one row of
+# 784 inputs per image)
+def compress_sketches(pixels):
+
+    # compress image from 224x224 obtained from browser to 28x28
+    # as expected by MNIST-trained ANN, by averaging each 8x8 block:
+    # split rows and columns into (block, pixel within block) and
+    # take the mean over the pixels within each block
+    block_height = config.sketchpad_height // config.pixel_height
+    block_width = config.sketchpad_width // config.pixel_width
+    blocks = pixels.reshape(len(pixels), config.pixel_height, block_height,
+                            config.pixel_width, block_width)
+    new_arr = blocks.mean(axis=(2, 4))
+
+    # scale and shift the inputs (after compressing, so only 784 values)
+    # - matches scaling every pixel before averaging to within 1e-15
+    inputs = (new_arr.reshape(len(pixels), 784) / 255.0 * 0.99) + 0.01
+
+    return inputs
+
+
 # reformat and compress sketchpad image received from browser,
 # reformat again for use by ANN
 def compress_image(input_string):
 
-    # split string into list sepated by ","
-    # scale and shift the inputs
-    inputs = (numpy.asfarray(input_string.split(',')) / 255.0 * 0.99) + 0.01
+    # parse the comma separated darkness readings (0 - 255) directly
+    # into a buffer of bytes, one per pixel of the sketchpad
+    pixels = numpy.fromstring(input_string, dtype=numpy.uint8, sep=',')
 
-    # compress image from 224x224 obtained from browser to 28x28
-    # as expected by MNIST-trained ANN
-    new_arr = numpy.zeros((main.pixel_width, main.pixel_height))
-    arr = numpy.array(inputs).reshape(224, 224)
-    for i in range(0, 224, 8):
-        for j in range(0, 224, 8):
-            temp_array = arr[i:i + 8, j:j + 8]
-            new_arr[i // 8, j // 8] = numpy.mean(temp_array)
+    return compress_pixels(pixels)
+
+
+# reformat sketchpad image received as raw bytes (one byte per pixel) for use
+# by ANN - either the full 224x224 sketchpad or already compressed to 28x28
+def decode_image_bytes(image_bytes):
 
-    inputs_list = numpy.array(new_arr).reshape(784, )
+    pixels = numpy.frombuffer(image_bytes, dtype=numpy.uint8)
 
-    return inputs_list
+    if pixels.size == config.pixel_width * config.pixel_height:
+        # already compressed by browser, so only scale and shift the inputs
+        return (pixels / 255.0 * 0.99) + 0.01
+
+    return compress_pixels(pixels)
+
+
+# confidence band for a confidence level (as a %), applied to a whole array:
+# "high", "medium", "low" or "no" depending on the thresholds in config.py
+def confidence_bands(confidences):
+
+    band_names = numpy.array(["no", "low", "medium", "high"])
+    thresholds = [
+        config.low_threshold, config.medium_threshold, config.high_threshold
+    ]
+
+    return band_names[numpy.digitize(confidences, thresholds)]
 
 
 # process sketchpad image received from browser, including querying ANN and
 # preparing prediction/confidence data, for all scenarios
 def process_image(input_string):
 
-    inputs_list = compress_image(input_string)
+    with metrics.span("compress_image"):
+        inputs_list = compress_image(input_string)
+
+    return process_inputs(inputs_list)
+
+
+# query ANN with a compressed sketchpad image (784 inputs) using the given
+# weights and work out prediction/confidence data, for all scenarios
+def query_ann(inputs_list, models):
+
+    # convert inputs list to 2d array
+    inputs = numpy.array(inputs_list, ndmin=2).T
 
-    # initialise other lists
-    outputs = []
-    sum_of_outputs = []
-    new_outputs = []
-    ranked_outputs = []
-    index = []
-    predicted_labels = []
-    confidence_levels = []
+    # query the neural network for all scenarios in one pass:
+    # inputs = image originating from sketchpad,
+    # outputs give confidence levels for each possible digit (0 - 9),
+    # one row per scenario
+    # (in the precision chosen for queries, see activate_precision)
+    with metrics.span("forward_prop"):
+        not_used, outputs = ANN.forward_prop_inference(
+            inputs, models["inference"])
 
-    # run query based on input from sketchpad
-    # looping through 4 scenarios
-    for i in range(0, 4):
+    with metrics.span("post_processing"):
+        return prediction_data(outputs[:, :, 0].astype(numpy.float64))
 
-        # read weights from file
-        wih = loadtxt('weights_wih_' + str(i) + '.csv', delimiter=',')
-        who = loadtxt('weights_who_' + str(i) + '.csv', delimiter=',')
 
-        # convert inputs list to 2d array
-        inputs = numpy.array(inputs_list, ndmin=2).T
+# query ANN with several compressed sketchpad images at once (one column per
+# image, in one batched forward pass) and work out prediction/confidence data
+# for each image, for all scenarios - run by inference_scheduler.py
+def query_ann_batch(models, inputs_lists):
 
-        # query the neural network: inputs = image originating from sketchpad,
-        # outputs give confidence levels for each possible digit (0 - 9)
-        not_used, myoutput = ANN.forward_prop(inputs, wih, who)
-        outputs.append(myoutput)
-        sum_of_outputs.append(sum(outputs[i]))
+    inputs = numpy.array(inputs_lists, ndmin=2).T
 
-        temp_outputs = []
-        for output in outputs[i]:
-            output = numpy.round((output[0] / sum_of_outputs[i]) * 100, 2)
-            temp_outputs.append(output[0])
-        new_outputs.append(temp_outputs)
+    tic = time.perf_counter()
+    not_used, outputs = ANN.forward_prop_inference(inputs, models["inference"])
+    metrics.observe("ann_stage_seconds",
+                    time.perf_counter() - tic,
+                    stage="batched_forward_prop")
 
-        # sort in descending order while retaining index
-        ranked_outputs.append(
-            sorted(enumerate(new_outputs[i]), key=lambda x: x[1],
-                   reverse=True))
+    outputs = outputs.astype(numpy.float64)
 
-        # grab prediction by getting index of largest output
-        index.append(numpy.argmax(outputs[i]))
+    # post-processing timed for each query, as in query_ann (the forward
+    # pass is shared, so is timed once for the batch above)
+    predictions = []
+    for k in range(len(inputs_lists)):
+        tic = time.perf_counter()
+        predictions.append(prediction_data(outputs[:, :, k]))
+        metrics.observe("ann_stage_seconds",
+                        time.perf_counter() - tic,
+                        stage="post_processing")
 
-        # return as string
-        predicted_labels.append(str(index[0]))
+    return predictions
 
-        confidence_levels.append(str((ranked_outputs[i][0][1])) + "%")
 
-    # ranked list (for main scenario only)
-    ranked_index_list = []
-    ranked_value_list = []
+# turn outputs of ANN (one row of 10 outputs per scenario) into
+# prediction/confidence data
+def prediction_data(outputs):
 
-    for item in ranked_outputs[3]:
-        ranked_index_list.append(item[0])
-        ranked_value_list.append(str(item[1]) + "%")
+    # normalise outputs of each scenario so they add up to 100%
+    new_outputs = numpy.round(
+        outputs / outputs.sum(axis=1, keepdims=True) * 100, 2)
+
+    # rank digits in descending order of confidence for each scenario
+    # (stable sort, so equal confidences keep the lower digit first)
+    ranked_indices = numpy.argsort(-new_outputs, axis=1, kind='stable')
+    ranked_outputs = numpy.take_along_axis(new_outputs, ranked_indices, axis=1)
+
+    # grab prediction by getting index of largest output, for each scenario
+    predicted_labels = numpy.argmax(outputs, axis=1).astype(str).tolist()
+    confidence_levels = [
+        str(value) + "%" for value in ranked_outputs[:, 0].tolist()
+    ]
+
+    # ranked list (for headline scenario only)
+    headline = config.headline_scenario
+    ranked_index_list = ranked_indices[headline].tolist()
+    ranked_value_list = [
+        str(value) + "%" for value in ranked_outputs[headline].tolist()
+    ]
 
     # set confidence band for headline scenario
-    if ranked_outputs[3][0][1] >= main.high_threshold:
-        confidence_band = "high"
-    elif ranked_outputs[3][0][1] >= main.medium_threshold:
-        confidence_band = "medium"
-    elif ranked_outputs[3][0][1] >= main.low_threshold:
-        confidence_band = "low"
+    confidence_band = str(confidence_bands(ranked_outputs[:, 0])[headline])
+
+    predictions = {
+        "predictions": predicted_labels,
+        "confidences": confidence_levels,
+        "confidence_band": confidence_band,
+        "indices": ranked_index_list,
+        "values": ranked_value_list
+    }
+
+    return predictions
+
+
+# key identifying a query in the prediction cache: a hash of the inputs
+# quantised to 256 levels (so re-submits of the same drawing match) and
+# the version of the weights used to answer it
+def prediction_cache_key(inputs_list, version):
+
+    quantised = numpy.round(numpy.asarray(inputs_list) * 255).astype(
+        numpy.uint8)
+    key = hashlib.blake2b(quantised.tobytes(), digest_size=16)
+    key.update(str(version).encode())
+
+    return key.hexdigest()
+
+
+# prediction/confidence data for a compressed sketchpad image, from the
+# prediction cache if the same image has been queried with the same weights
+def cached_query_ann(inputs_list, models):
+    global _prediction_cache_version
+
+    key = prediction_cache_key(inputs_list, models["version"])
+
+    with _prediction_cache_lock:
+        # new weights have been loaded, so earlier answers no longer apply
+        # (a request still holding older weights leaves the cache alone)
+        if (_prediction_cache_version is None
+                or models["version"] > _prediction_cache_version):
+            _prediction_cache.clear()
+            _prediction_cache_version = models["version"]
+
+        predictions = _prediction_cache.get(key)
+        if predictions is not None:
+            _prediction_cache.move_to_end(key)
+            prediction_cache_stats["hits"] += 1
+            return predictions
+        prediction_cache_stats["misses"] += 1
+
+    # query outside the lock, so other requests are not held up -
+    # in a batch with any concurrent queries if micro-batching is on
+    if config.micro_batching:
+        with metrics.span("scheduled_query"):
+            predictions = inference_scheduler.submit(query_ann_batch, models,
+                                                     inputs_list)
     else:
-        confidence_band = "no"
+        predictions = query_ann(inputs_list, models)
+
+    # (answers from older weights are not cached)
+    with _prediction_cache_lock:
+        if models["version"] == _prediction_cache_version:
+            _prediction_cache[key] = predictions
+            _prediction_cache.move_to_end(key)
+            # evict the least recently used answers beyond the cache size
+            while len(_prediction_cache) > config.prediction_cache_size:
+                _prediction_cache.popitem(last=False)
+                prediction_cache_stats["evictions"] += 1
+
+    return predictions
+
+
+# hit/miss/eviction counts and current size of the prediction cache
+def get_prediction_cache_stats():
+
+    with _prediction_cache_lock:
+        stats = dict(prediction_cache_stats)
+        stats["size"] = len(_prediction_cache)
+        stats["max_size"] = config.prediction_cache_size
+
+    return stats
+
+
+# query ANN with a compressed sketchpad image (784 inputs) and
+# prepare prediction/confidence data, for all scenarios
+def process_inputs(inputs_list):
+
+    # take one consistent set of weights for the whole query
+    # (a reload in the background swaps in a new set, never changes this one)
+    with metrics.span("weights"):
+        models = model_registry.get_models()
+
+    predictions = cached_query_ann(inputs_list, models)
 
     # prepare parameters for sending to browser
+    # (copies of the lists, so the cached answer cannot be changed)
     parameters = initialise_parameters()
-    parameters["predictions"] = predicted_labels
-    parameters["confidences"] = confidence_levels
-    parameters["confidence_band"] = confidence_band
-    parameters["indices"] = ranked_index_list
-    parameters["values"] = ranked_value_list
+    parameters["predictions"] = list(predictions["predictions"])
+    parameters["confidences"] = list(predictions["confidences"])
+    parameters["confidence_band"] = predictions["confidence_band"]
+    parameters["indices"] = list(predictions["indices"])
+    parameters["values"] = list(predictions["values"])
+
+    return parameters
+
+
+# accuracy (fraction of correct top predictions) of every scenario on the
+# test dataset, using weights prepared by ANN.inference_weights
+def score_test_set(inference_weights, test_data, chunk_size=2000):
+
+    images, labels = test_data
+    correct = numpy.zeros(inference_weights["wih"].shape[0], dtype=numpy.int64)
+
+    for start in range(0, len(labels), chunk_size):
+        # normalise and shift the inputs, one column per record
+        inputs = mnist_data.scale_inputs(images[start:start + chunk_size]).T
+        not_used, outputs = ANN.forward_prop_inference(inputs,
+                                                       inference_weights)
+        # top prediction of each scenario for each record
+        top_predictions = numpy.argmax(outputs, axis=1)
+        correct += (top_predictions == labels[start:start + chunk_size]).sum(
+            axis=1)
+
+    return correct / max(len(labels), 1)
+
+
+# accuracy (%) of every scenario of models re-scored on the MNIST test dataset
+# in precision (see ANN.inference_weights) - raises ValueError if any is more
+# than margin (% points) below its accuracy in test_scores.csv
+def check_precision(models, precision, margin=None):
+
+    if margin is None:
+        margin = config.precision_margin
+
+    weights = model_registry.stacked_inference_weights(models["wih"],
+                                                       models["who"],
+                                                       precision)
+
+    test_data = mnist_data.load_dataset("mnist_test.csv")
+    accuracies = score_test_set(weights, test_data) * 100
+    expected = [
+        float(score.strip().rstrip('%')) for score in load_test_scores()
+    ]
+
+    for i in range(len(accuracies)):
+        if accuracies[i] < expected[i] - margin:
+            raise ValueError(precision + " accuracy for scenario " + str(i) +
+                             " is " + str(round(accuracies[i], 2)) +
+                             "%, more than " + str(margin) +
+                             " points below " + str(expected[i]) + "%")
+
+    return accuracies
+
+
+# switch queries to a reduced precision, but only if the weights in use pass
+# check_precision - raises ValueError (and keeps the current precision)
+# otherwise; weights swapped in later are checked the same way (see
+# model_registry.apply_precision)
+def activate_precision(precision, margin=None):
+
+    models = model_registry.get_models()
+    accuracies = check_precision(models, precision, margin)
+
+    model_registry.set_precision(
+        precision, lambda models, precision: check_precision(
+            models, precision, margin), models)
 
-    return parameters
\ No newline at end of file
+    return accuracies
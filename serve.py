@@ -0,0 +1,302 @@
+###################################################################################
+#
+#   Production entry point for the realtime application
+#
+#   Serves the Flask app in main.py with several worker processes, each
+#   answering requests on a pool of threads, instead of Flask's single-process
+#   development server. Weights for all scenarios are loaded once in the parent
+#   process before the workers are forked, so every worker shares the same
+#   pages of weights (copy-on-write) rather than each loading its own copy
+#
+#   Each worker is recycled after max_requests requests (plus a random jitter,
+#   so workers do not all restart at once): it stops accepting connections,
+#   finishes the requests it has in hand and exits, and the parent forks a
+#   replacement. Sending SIGHUP to the parent recycles every worker the same
+#   way; SIGTERM / SIGINT stop the server, giving workers graceful_timeout
+#   seconds to finish their requests
+#
+#   Uses gunicorn if it is installed (with the same settings), otherwise a
+#   small pre-forking server built on werkzeug (which comes with Flask)
+#
+#   run as:
+#         python serve.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+#
+#   /health reports the process is up; /ready only reports ready once the
+#   weights are loaded into memory (see main.py)
+#
+###################################################################################
+
+# argparse for the command line options
+import argparse
+# concurrent.futures for the pool of threads in each worker
+from concurrent.futures import ThreadPoolExecutor
+# os, signal and socket for forking workers and sharing the listening socket
+import os
+import signal
+import socket
+# random for spreading out the recycling of workers
+import random
+# sys and traceback for reporting a worker that fails
+import sys
+import traceback
+# threading for stopping a worker's server from a request thread
+import threading
+# time for waiting on workers
+import time
+# werkzeug (installed with Flask) for the built-in server
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+# the Flask app and its weights
+import main
+import model_registry
+# global constants (see config.py)
+import config
+
+# gunicorn is optional - the built-in server is used without it
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+# default settings
+workers = os.cpu_count() or 1
+threads = 4
+max_requests = 1000
+max_requests_jitter = 100
+graceful_timeout = 30.0
+bind = "127.0.0.1:5000"
+
+
+# requests in the built-in server are answered with HTTP/1.0 (one request
+# per connection), so idle keep-alive connections never hold a thread
+class RequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+
+# werkzeug server handling each request on a fixed pool of threads, which
+# stops itself after max_requests requests (so the worker can be recycled)
+class PooledWSGIServer(BaseWSGIServer):
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, host, port, app, fd, threads, max_requests):
+
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self.pool = ThreadPoolExecutor(threads,
+                                       thread_name_prefix="request-thread")
+        self.max_requests = max_requests
+        self.requests = 0
+        self.stopping = False
+
+    # hand the request to the pool instead of answering it here
+    def process_request(self, request, client_address):
+
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+        self.requests += 1
+        if self.max_requests and self.requests >= self.max_requests:
+            self.stop()
+
+    def process_request_thread(self, request, client_address):
+
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    # stop accepting connections (serve_forever returns); requests already
+    # handed to the pool are still answered
+    def stop(self):
+
+        if not self.stopping:
+            self.stopping = True
+            # shutdown waits for serve_forever, so cannot be called from it
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+
+# listening socket for host:port, shared by every worker
+def listening_socket(address):
+
+    host, port = address.rsplit(":", 1)
+    sock = socket.create_server((host, int(port)), backlog=128)
+    sock.set_inheritable(True)
+
+    return sock
+
+
+# forked worker process: answer requests until stopped or recycled, then exit
+def run_worker(sock, settings):
+
+    # only the parent handles Ctrl-C and SIGHUP (and passes them on)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # threads do not survive a fork, so start the watcher in each worker
+    model_registry.start_watcher()
+
+    host, port = sock.getsockname()[:2]
+    limit = settings["max_requests"]
+    if limit:
+        limit += random.randint(0, settings["max_requests_jitter"])
+    server = PooledWSGIServer(host, port, main.app, sock.fileno(),
+                              settings["threads"], limit)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+
+    server.serve_forever()
+    # answer requests in hand before exiting
+    server.pool.shutdown(wait=True)
+
+
+# fork a worker process, returning its process id
+def start_worker(sock, settings):
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            run_worker(sock, settings)
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            # never return into the parent's code
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    return pid
+
+
+# send a signal to every worker (ignoring any that have already exited)
+def signal_workers(children, signum):
+
+    for pid in list(children):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+# built-in pre-forking server: parent forks the workers and replaces any
+# that exit (e.g. when recycled) until it is told to stop
+def run_prefork(settings):
+
+    sock = listening_socket(settings["bind"])
+    children = set()
+    state = {"stopping": False}
+
+    def stop(signum, frame):
+        state["stopping"] = True
+
+    def recycle(signum, frame):
+        signal_workers(children, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, recycle)
+
+    print("Serving on http://" + settings["bind"] + " with " +
+          str(settings["workers"]) + " workers of " +
+          str(settings["threads"]) + " threads")
+
+    while not state["stopping"]:
+        while len(children) < settings["workers"]:
+            children.add(start_worker(sock, settings))
+        # reap workers that have exited, so they are replaced
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid in children:
+            children.discard(pid)
+            if os.waitstatus_to_exitcode(status) != 0:
+                # don't fork a worker that keeps failing in a tight loop
+                print("Worker " + str(pid) + " failed (exit code " +
+                      str(os.waitstatus_to_exitcode(status)) + ")")
+                time.sleep(1.0)
+        else:
+            time.sleep(0.2)
+
+    # graceful stop: workers finish requests in hand, then are killed
+    signal_workers(children, signal.SIGTERM)
+    deadline = time.monotonic() + settings["graceful_timeout"]
+    while children and time.monotonic() < deadline:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid in children:
+            children.discard(pid)
+        else:
+            time.sleep(0.1)
+    signal_workers(children, signal.SIGKILL)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+    sock.close()
+
+
+# serve with gunicorn, with the same settings as the built-in server
+def run_gunicorn(settings):
+
+    class Application(BaseApplication):
+
+        def load_config(self):
+
+            self.cfg.set("bind", settings["bind"])
+            self.cfg.set("workers", settings["workers"])
+            self.cfg.set("threads", settings["threads"])
+            self.cfg.set("max_requests", settings["max_requests"])
+            self.cfg.set("max_requests_jitter",
+                         settings["max_requests_jitter"])
+            self.cfg.set("graceful_timeout", settings["graceful_timeout"])
+            # the app (with its weights) is already loaded in this process
+            self.cfg.set("preload_app", True)
+            self.cfg.set(
+                "post_fork",
+                lambda server, worker: model_registry.start_watcher())
+
+        def load(self):
+            return main.app
+
+    Application().run()
+
+
+# this if statement stops the code below being executed when this file is imported
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Serve the app with several worker processes")
+    parser.add_argument("--bind", default=bind, help="host:port")
+    parser.add_argument("--workers", type=int, default=workers)
+    parser.add_argument("--threads", type=int, default=threads)
+    parser.add_argument("--max-requests",
+                        type=int,
+                        default=max_requests,
+                        help="recycle a worker after this many requests "
+                        "(0 = never)")
+    parser.add_argument("--max-requests-jitter",
+                        type=int,
+                        default=max_requests_jitter)
+    parser.add_argument("--graceful-timeout",
+                        type=float,
+                        default=graceful_timeout)
+    parser.add_argument("--builtin",
+                        action="store_true",
+                        help="use the built-in server even if gunicorn is "
+                        "installed")
+    args = parser.parse_args()
+    settings = vars(args)
+
+    # online fine-tuning needs one process holding the fine-tuned weights:
+    # with several workers each would fine-tune its own copy, and a recycled
+    # worker would lose them (it is forked from this process again)
+    if config.online_fine_tuning and (args.workers > 1 or args.max_requests):
+        config.online_fine_tuning = False
+        print("Online fine-tuning switched off: needs --workers 1 "
+              "--max-requests 0")
+
+    # load weights once, before forking, so every worker shares them
+    main.prepare_models()
+
+    if BaseApplication is not None and not args.builtin:
+        run_gunicorn(settings)
+    else:
+        run_prefork(settings)
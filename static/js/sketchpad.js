@@ -84,6 +84,7 @@ function clearCanvas(canvas, ctx) {
     document.getElementById("prediction2").innerHTML =
         "<h5>&nbsp;&nbsp;</h5>";
     toggleVisibility("tbodyid");
+    showFeedback(false);
 }
 
 // Keep track of the mouse button being pressed and draw dot
@@ -263,3 +264,130 @@ function getImage(canvas, ctx) {
 
     return result;
 }
+
+// Compress image from 224x224 to 28x28 by averaging each 8x8 block of
+// darkness readings (as done on the server), one byte per pixel
+function compressImage(px, width, height) {
+    var pixels = 28;
+    var block = width / pixels;
+    var compressed = new Uint8Array(pixels * pixels);
+
+    for (var row = 0; row < pixels; row++) {
+        for (var col = 0; col < pixels; col++) {
+            var total = 0;
+            for (var y = row * block; y < (row + 1) * block; y++) {
+                for (var x = col * block; x < (col + 1) * block; x++) {
+                    // darkness reading is the alpha value of each pixel
+                    total += px[(y * width + x) * 4 + 3];
+                }
+            }
+            compressed[row * pixels + col] = Math.round(total / (block * block));
+        }
+    }
+    return compressed;
+}
+
+// Last image sent to /api/predict (compressed), for sending feedback on it
+var lastImage = null;
+
+// Show or hide the question asking which digit was drawn
+// (not on the page while online fine-tuning is switched off)
+function showFeedback(show) {
+    var feedback = document.getElementById("feedback");
+    if (feedback === null) {
+        return;
+    }
+    document.getElementById("feedbackfield").innerHTML = "";
+    feedback.style.visibility = show ? "visible" : "hidden";
+}
+
+// Send the last image submitted and the digit actually drawn (confirming or
+// correcting the prediction) to /api/feedback, to fine-tune the ANN
+function sendFeedback(label) {
+    if (lastImage === null || !window.fetch) {
+        return;
+    }
+    var field = document.getElementById("feedbackfield");
+    fetch("/api/feedback?label=" + label, {
+        method: "POST",
+        headers: { "Content-Type": "application/octet-stream" },
+        body: lastImage
+    })
+        .then(function (response) {
+            field.innerHTML = response.ok ? "Thank you!" : "Not sent, please try later";
+        })
+        .catch(function (error) {
+            console.log(error);
+            field.innerHTML = "Not sent, please try later";
+        });
+    // one piece of feedback per image
+    lastImage = null;
+}
+
+// Show prediction/confidence data returned by /api/predict
+function showPredictions(result) {
+    document.getElementById("myprediction").innerHTML =
+        "<h2 style='font-size:12vw'>&nbsp;&nbsp;" + result.indices[0] + "</h2>";
+    document.getElementById("prediction2").innerHTML =
+        "<h5>&nbsp;&nbsp;&nbsp;&nbsp;with <u>" + result.confidence_band +
+        "</u> Confidence  </h5>";
+
+    // ranked table (for main scenario only)
+    var rows = "";
+    for (var i = 0; i < result.indices.length; i++) {
+        rows += "<tr><td>&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;" + result.indices[i] +
+            "</td><td>&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;" + result.values[i] +
+            "</td></tr>";
+    }
+    var tbody = document.getElementById("tbodyid");
+    tbody.innerHTML = rows;
+    tbody.style.visibility = "visible";
+
+    // ask which digit was drawn
+    showFeedback(true);
+
+    // further training scenarios
+    for (var s = 0; s < 3; s++) {
+        document.getElementById("scenario_prediction_" + s).innerHTML =
+            "&nbsp;" + result.predictions[s];
+        document.getElementById("scenario_confidence_" + s).innerHTML =
+            "Confidence:  " + result.confidences[s];
+    }
+}
+
+// Send image to /api/predict and update the page without reloading it;
+// if that is not possible the form is submitted as before
+function submitImage(canvas, ctx, form) {
+
+    // checks for a sketch and fills in the form (used as the fallback)
+    if (!getImage(canvas, ctx)) {
+        return false;
+    }
+    if (!window.fetch) {
+        return true;
+    }
+
+    var imageData = ctx.getImageData(0, 0, canvas.width, canvas.height);
+    var compressed = compressImage(imageData.data, canvas.width, canvas.height);
+    lastImage = compressed;
+
+    document.getElementById("errorfield").innerHTML = "";
+    fetch("/api/predict", {
+        method: "POST",
+        headers: { "Content-Type": "application/octet-stream" },
+        body: compressed
+    })
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error("prediction failed: " + response.status);
+            }
+            return response.json();
+        })
+        .then(showPredictions)
+        .catch(function (error) {
+            console.log(error);
+            form.submit();
+        });
+
+    return false;
+}
@@ -0,0 +1,253 @@
+###################################################################################
+#
+#   Hyperparameter sweep
+#
+#   Trains and tests the ANN for every combination in a grid of hidden_nodes,
+#   learning_rate, number of epochs and number of training records, running the
+#   trials across a pool of worker processes. Every worker memory-maps the same
+#   cached copy of the MNIST training and test data (see mnist_data.py), so
+#   the datasets are parsed once and held in memory once
+#
+#   Each finished trial is written to a result store (a directory holding
+#   trial_<key>.json with its accuracy and timing, and trial_<key>.npz with its
+#   weights), so running the same sweep again skips the trials already done -
+#   an interrupted sweep is continued simply by running it again
+#
+#   Ends with a table of trials ranked by accuracy, alongside the time each
+#   took to train; "*" marks trials no faster trial beats on accuracy
+#
+#   run as:
+#         python sweep.py --hidden-nodes 100 200 400 --learning-rates 0.05 0.1 0.2
+#                         --epochs 1 5 --num-lines 60000 --workers 4
+#
+#   calls:
+#         train_and_test.py
+#         mnist_data.py
+#         model_files.py
+#         atomic_files.py
+#         worker_pools.py
+#
+###################################################################################
+
+# argparse for the command line options
+import argparse
+# hashlib and json for the result store
+import hashlib
+import json
+# itertools for the combinations in the grid
+import itertools
+# os for the result store
+import os
+# time for timing each trial
+import time
+# numpy for various mathematical actions (e.g. use of matrices)
+import numpy
+# global constants (see config.py)
+import config
+# writing files atomically
+import atomic_files
+# MNIST datasets, parsed once and cached (workers memory-map the same cache)
+import mnist_data
+# binary model files, for the weights of each trial
+import model_files
+# pools of worker processes using one core each
+from worker_pools import single_threaded_workers
+# training step, evaluation and initial weights
+import train_and_test
+
+# default result store
+results_directory = "sweep_results"
+
+
+# key identifying a trial in the result store (same settings = same key)
+def trial_key(trial):
+    return hashlib.blake2b(json.dumps(trial, sort_keys=True).encode(),
+                           digest_size=8).hexdigest()
+
+
+# file names of the results and weights of a trial
+def trial_files(directory, trial):
+
+    base_name = os.path.join(directory, "trial_" + trial_key(trial))
+
+    return base_name + ".json", base_name + ".npz"
+
+
+# every combination of the values given for each setting, as trials
+def grid_trials(hidden_nodes, learning_rates, epochs, num_lines, batch_size,
+                seed):
+
+    return [{
+        "hidden_nodes": nodes,
+        "learning_rate": rate,
+        "num_epochs": num_epochs,
+        "num_lines": lines,
+        "batch_size": batch_size,
+        "seed": seed
+    } for nodes, rate, num_epochs, lines in itertools.product(
+        hidden_nodes, learning_rates, epochs, num_lines)]
+
+
+# results of a trial from the result store, or None if it has not been run
+def load_result(directory, trial):
+
+    results_file, weights_file = trial_files(directory, trial)
+    if not (os.path.exists(results_file) and os.path.exists(weights_file)):
+        return None
+
+    with open(results_file, 'r') as f:
+        return json.load(f)
+
+
+# train and test one trial, saving its results and weights to the store
+# (runs in a worker process)
+def run_trial(task):
+    #
+    #  task = (result store directory, trial settings)
+    #
+    directory, trial = task
+
+    # settings of this trial in place of those in config.py
+    config.configuration.update(hidden_nodes=trial["hidden_nodes"],
+                                learning_rate=trial["learning_rate"],
+                                batch_size=trial["batch_size"])
+    numpy.random.seed(trial["seed"])
+    wih, who = train_and_test.initialise_for_train_and_test()
+
+    images, labels = mnist_data.load_dataset("mnist_train.csv")
+    images = images[0:trial["num_lines"]]
+    labels = labels[0:trial["num_lines"]]
+    batch_size = trial["batch_size"]
+
+    tic = time.perf_counter()
+    for epoch in range(trial["num_epochs"]):
+        for start in range(0, len(labels), batch_size):
+            train_and_test.training_step(images[start:start + batch_size],
+                                         labels[start:start + batch_size],
+                                         wih, who)
+    toc = time.perf_counter()
+
+    test_data = mnist_data.load_dataset("mnist_test.csv")
+    results = train_and_test.evaluation(test_data, wih, who)
+
+    result = {
+        "trial": trial,
+        "accuracy": results["accuracy"],
+        "training_seconds": toc - tic,
+        "samples_per_second": len(labels) * trial["num_epochs"] / (toc - tic),
+        "test_seconds": results["seconds"]
+    }
+
+    # weights first, so a trial with results always has its weights
+    results_file, weights_file = trial_files(directory, trial)
+    model_files.save_model(weights_file, wih, who, {
+        "configuration": dict(config.configuration),
+        "training": trial
+    })
+    atomic_files.write_atomically(results_file,
+                                  lambda f: json.dump(result, f, indent=2),
+                                  mode='w')
+
+    return result
+
+
+# run the trials not already in the result store across a pool of workers,
+# returning the results of every trial
+def run_sweep(trials, directory, workers):
+
+    os.makedirs(directory, exist_ok=True)
+
+    results = []
+    pending = []
+    for trial in trials:
+        result = load_result(directory, trial)
+        if result is None:
+            pending.append(trial)
+        else:
+            results.append(result)
+
+    print(str(len(trials)) + " trials, " + str(len(results)) +
+          " already in " + directory + ", running " + str(len(pending)))
+    if not pending:
+        return results
+
+    # make sure the cached datasets exist before workers map them
+    mnist_data.load_dataset("mnist_train.csv")
+    mnist_data.load_dataset("mnist_test.csv")
+
+    with single_threaded_workers() as context:
+        with context.Pool(min(workers, len(pending))) as pool:
+            tasks = [(directory, trial) for trial in pending]
+            for result in pool.imap_unordered(run_trial, tasks):
+                print(describe(result["trial"]) +
+                      f" accuracy={result['accuracy'] * 100:0.2f}%"
+                      f" seconds={result['training_seconds']:0.1f}")
+                results.append(result)
+
+    return results
+
+
+# settings of a trial on one line
+def describe(trial):
+    return (f"hidden_nodes={trial['hidden_nodes']}"
+            f" learning_rate={trial['learning_rate']}"
+            f" epochs={trial['num_epochs']} num_lines={trial['num_lines']}")
+
+
+# print results ranked by accuracy, marking with "*" the trials that no
+# faster trial beats on accuracy (the best choices for their training time)
+def report(results):
+
+    ranked = sorted(results,
+                    key=lambda result:
+                    (-result["accuracy"], result["training_seconds"]))
+
+    best_so_far = -1.0
+    best_for_time = set()
+    for result in sorted(results,
+                         key=lambda result: result["training_seconds"]):
+        if result["accuracy"] > best_so_far:
+            best_so_far = result["accuracy"]
+            best_for_time.add(id(result))
+
+    print(f"{'rank':>4} {'accuracy':>9} {'train (s)':>10} {'samples/s':>10}"
+          f" {'hidden':>7} {'rate':>6} {'epochs':>7} {'records':>8}")
+    for rank, result in enumerate(ranked, 1):
+        trial = result["trial"]
+        print(f"{rank:>4} {result['accuracy'] * 100:>8.2f}%"
+              f" {result['training_seconds']:>10.1f}"
+              f" {result['samples_per_second']:>10.0f}"
+              f" {trial['hidden_nodes']:>7} {trial['learning_rate']:>6}"
+              f" {trial['num_epochs']:>7} {trial['num_lines']:>8}" +
+              (" *" if id(result) in best_for_time else ""))
+
+
+# this if statement stops the code below being executed when this file is imported
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run a hyperparameter sweep")
+    parser.add_argument("--hidden-nodes",
+                        type=int,
+                        nargs="+",
+                        default=[config.configuration["hidden_nodes"]])
+    parser.add_argument("--learning-rates",
+                        type=float,
+                        nargs="+",
+                        default=[config.configuration["learning_rate"]])
+    parser.add_argument("--epochs", type=int, nargs="+", default=[1])
+    parser.add_argument("--num-lines", type=int, nargs="+", default=[60000])
+    parser.add_argument("--batch-size",
+                        type=int,
+                        default=config.configuration["batch_size"])
+    parser.add_argument("--seed",
+                        type=int,
+                        default=0,
+                        help="seed for the initial weights of every trial")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--results", default=results_directory)
+    args = parser.parse_args()
+
+    trials = grid_trials(args.hidden_nodes, args.learning_rates, args.epochs,
+                         args.num_lines, args.batch_size, args.seed)
+    results = run_sweep(trials, args.results, args.workers)
+    report(results)
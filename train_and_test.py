@@ -12,17 +12,26 @@
 #
 #   Also generates accuracy for each scenario based on MNIST test dataset
 #
+#   As each scenario is a first part of the longest one, all are trained in a
+#   single pass through the training data, saving the weights of each scenario
+#   when the run reaches the point at which it is complete
+#
 #   Note: this script is run separately and in advance of the realtime application
 #   which is started by running main.py
 #
+#   The run is checkpointed every config.checkpoint_interval records and at the
+#   end of every epoch, so if it is interrupted it can be continued with:
+#         python train_and_test.py --resume
+#
 #   calls:
 #         ANN.py
 #
-#   files read in:
+#   files read in (via mnist_data.py, which caches them as .npy files):
 #         mnist_train.csv - MNIST handwritten digit training dataset
 #         mnist_test.csv - MNIST handwritten digit test dataset
 #
-#   files read from:
+#   files written to:
+#         model_0.npz ... model_3.npz - binary weights for each scenario
 #         weights_wih_0.csv - weights for input to hidden layers in scenario 0
 #         weights_wih_1.csv - weights for input to hidden layers in scenario 1
 #         weights_wih_2.csv - weights for input to hidden layers in scenario 2
@@ -32,59 +41,190 @@
 #         weights_who_2.csv - weights for hidden to output layers in scenario 2
 #         weights_who_3.csv - weights for hidden to output layers in scenario 3
 #         test_scores.csv - accuracy for each scenario based on MNIST test dataset
+#         test_metrics_0.csv ... test_metrics_3.csv - per-digit precision, recall
+#                                                     and confusion matrix
+#         training_checkpoint.npz - checkpoint of the run (removed at the end)
 #
 ###################################################################################
 
+# argparse for the command line options (e.g. --resume)
+import argparse
 # numpy for various mathematical actions (e.g. use of matrices)
 import numpy
 # savetxt is used to write to file
 from numpy import savetxt
 # time for measuring time taken to load MNIST files
 import time
-# access to main.py needed for global constants
-import main
+# structured timings of each phase of training and testing
+import metrics
+# global constants (see config.py)
+import config
 # access to ANN.py needed
 import ANN
+# binary (memory-mappable) model files
+import model_files
+# checkpoints of training runs
+import checkpoints
+# writing files atomically
+import atomic_files
+# MNIST datasets, parsed once and cached
+import mnist_data
+
+
+# file holding the latest checkpoint of the training run (see checkpoints.py)
+checkpoint_file = "training_checkpoint.npz"
+
+
+# utility function to save an array as text (e.g. CSV) atomically, so the
+# realtime application never reads a half-written file
+def save_text(file_name, array, **options):
+    atomic_files.write_atomically(file_name,
+                                  lambda f: savetxt(f, array, **options))
 
 
 # utility function to save test scores
 # (% accuracy for each scenario based on testing with MNIST test data)
 def save_test_scores(test_scores):
-    savetxt('test_scores.csv', test_scores, delimiter=',', fmt="%s")
+    save_text('test_scores.csv', test_scores, delimiter=',', fmt="%s")
 
 
 # utility function to load training data
 def load_training_data(num_lines):
 
-    ##### start clock for reading training data
-    tic = time.perf_counter()
+    ##### time reading training data
+    with metrics.span("read_training_data", log=True, records=num_lines):
+        # load the MNIST training data (images and labels)
+        # and take the first num_lines records
+        images, labels = mnist_data.load_dataset("mnist_train.csv")
+        images = images[0:num_lines]
+        labels = labels[0:num_lines]
 
-    # load the MNIST training data CSV file into a list
-    training_data_file = open("mnist_train.csv", 'r')
-    training_data_list = training_data_file.readlines()[0:num_lines]
-    training_data_file.close()
+    return images, labels
 
-    ##### stop clock for reading training data
-    toc = time.perf_counter()
-    print(f"Reading training data took {toc - tic:0.4f} seconds")
 
-    return training_data_list
+# utility function to save weights to file
+# (as CSV text and as a binary model file for fast loading by realtime_query)
+def save_weights(wih, who, wih_file, who_file, i):
 
+    save_text(wih_file, wih, delimiter=',')
+    save_text(who_file, who, delimiter=',')
 
-# utility function to save weights to file
-def save_weights(wih, who, wih_file, who_file):
+    model_files.save_scenario_model(i, wih, who)
+
+
+# train ANN on one batch of records from the training data set
+# (forward propagation, then backward propagation and gradient descent)
+def training_step(images, labels, wih, who):
+    #
+    #  images = pixel values of the records in the batch (one row per record)
+    #  labels = label of each record in the batch
+    #  wih = weights used between input and hidden layers (updated in place)
+    #  who = weights used between hidden and output layers (updated in place)
+    #
+
+    # arrays for this step, reused from earlier steps of the same size
+    workspace = ANN.training_workspace(wih, who, len(labels))
+
+    # normalise (so in range 0 - 1) and
+    # shift the inputs (ANN works best if avoid 0)
+    # (as mnist_data.scale_inputs, written straight into the workspace)
+    input_rows = workspace["input_rows"]
+    numpy.divide(images, 255.0, out=input_rows)
+    input_rows *= 0.99
+    input_rows += 0.01
+    # set up target output values based on label in MNIST data
+    # the output corresponding to the label is set to 0.99
+    # the other outputs are set to 0.01
+    # (shifted from 1 and 0 respectively to avoid causing problems for ANN)
+    # one column per record
+    targets = workspace["targets"]
+    targets.fill(0.01)
+    targets[labels, workspace["records"]] = 0.99
+    # forward propagation, then backwards propagation
+    # (incl. error calculation & gradient descent), updating weights in place
+    wih, who = ANN.training_step_in_place(workspace, wih, who)
 
-    savetxt(wih_file, wih, delimiter=',')
-    savetxt(who_file, who, delimiter=',')
+    return wih, who
+
+
+# state of a new training run, which is checkpointed as it goes along
+def new_run(wih_init, who_init, scenario):
+    #
+    #  wih_init, who_init = initial weights of every scenario
+    #  scenario = scenario being trained, or None for a single pass
+    #             training all scenarios (see training_all_scenarios)
+    #
+    return {
+        "wih_init": wih_init,
+        "who_init": who_init,
+        "scenario": scenario,
+        # weights and position reached (no weights = start of the scenario)
+        "wih": None,
+        "who": None,
+        "epochs_done": 0,
+        "records_done": 0,
+        "seconds": 0.0,
+        "test_scores": []
+    }
+
+
+# save a checkpoint of a training run at a position (records_done records
+# into the epoch after epochs_done whole epochs) with the weights reached
+def save_training_checkpoint(run, wih, who, epochs_done, records_done, tic):
+
+    with metrics.span("checkpoint",
+                      log=True,
+                      epochs_done=epochs_done,
+                      records_done=records_done):
+        state = {
+            "scenario": run["scenario"],
+            "epochs_done": epochs_done,
+            "records_done": records_done,
+            "seconds": time.perf_counter() - tic,
+            "test_scores": run["test_scores"],
+            "configuration": config.configuration,
+            "scenarios": config.scenarios
+        }
+        checkpoints.save_checkpoint(
+            checkpoint_file, {
+                "wih": wih,
+                "who": who,
+                "wih_init": run["wih_init"],
+                "who_init": run["who_init"]
+            }, state)
+
+
+# load the training run to resume from its checkpoint (None if there is no
+# checkpoint) - raises ValueError if the checkpoint was made with a
+# different configuration or scenarios, as resuming would mix the two
+def load_training_checkpoint():
+
+    arrays, state = checkpoints.load_checkpoint(checkpoint_file)
+    if state is None:
+        return None
+
+    if (state.pop("configuration") != config.configuration
+            or state.pop("scenarios") != config.scenarios):
+        raise ValueError(checkpoint_file + " was made with a different "
+                         "configuration or scenarios")
+
+    state.update(arrays)
+
+    return state
 
 
 # load and prepare training data, then iterate through epochs
 # and records performing forward and backward propagation
-def training(i, wih_init, who_init):
+def training(i, wih_init, who_init, test_data=None, run=None):
     #
     #  i = scenario index
     #  wih_init = initial weights used between input and hidden layers
     #  who_init = initial weights used between hidden and output layers
+    #  test_data = if given, test images and labels used to report
+    #              the accuracy after every epoch
+    #  run = if given, the training run (see new_run) that this is part of -
+    #        checkpointed as it goes along, and continued from the position
+    #        reached if it has one for scenario i (e.g. resumed)
     #
 
     ##### start clock for training
@@ -95,109 +235,305 @@ def training(i, wih_init, who_init):
     # set up file name for weights for hidden to output layers for current scenario
     who_file = "weights_who_" + str(i) + ".csv"
     # number of records (i.e. "samples") to be read in from MNIST training dataset
-    num_lines = main.scenarios[i]["num_lines"]
+    num_lines = config.scenarios[i]["num_lines"]
     # number of epochs (i.e. number of iterations through training dataset)
-    num_epochs = main.scenarios[i]["num_epochs"]
+    num_epochs = config.scenarios[i]["num_epochs"]
 
     # load training data
-    training_data_list = load_training_data(num_lines)
+    images, labels = load_training_data(num_lines)
 
     # initialise weights used between input and hidden layers
-    wih = wih_init
+    # (a copy, as weights are updated in place and the initial weights
+    # are the starting point for every scenario)
+    wih = wih_init.copy()
     # initialise weights used between hidden and output layers
-    who = who_init
+    who = who_init.copy()
+
+    # number of records used for each update of the weights
+    # (1 = update after every record)
+    batch_size = config.configuration["batch_size"]
+
+    # continue from the position reached by a resumed run
+    first_epoch = 0
+    first_record = 0
+    if run is not None and run["scenario"] == i and run["wih"] is not None:
+        wih = run["wih"].copy()
+        who = run["who"].copy()
+        first_epoch = run["epochs_done"]
+        first_record = run["records_done"]
+        tic -= run["seconds"]
 
     # iterate through specified number of epochs
-    for epoch in range(num_epochs):
+    for epoch in range(first_epoch, num_epochs):
+        next_checkpoint = config.checkpoint_interval
         # iterate through specified number of records from the training data set
-        for record in training_data_list:
-            # split the record by the ',' commas
-            all_values = record.split(',')
-            # normalise (so in range 0 - 1) and
-            # shift the inputs (ANN works best if avoid 0)
-            inputs_list = (numpy.asfarray(all_values[1:]) / 255.0 *
-                           0.99) + 0.01
-            # set up target output values based on label in MNIST data
-            # the output corresponding to the label is set to 0.99
-            # the other outputs are set to 0.01
-            # (shifted from 1 and 0 respectively to avoid causing problems for ANN)
-            targets_list = numpy.zeros(
-                main.configuration["output_nodes"]) + 0.01
-            targets_list[int(all_values[0])] = 0.99
-            # convert inputs list to 2d array
-            inputs = numpy.array(inputs_list, ndmin=2).T
-            # convert targets list to 2d array
-            targets = numpy.array(targets_list, ndmin=2).T
-            # forward propagation
-            hidden_outputs, final_outputs = ANN.forward_prop(inputs, wih, who)
-            # backwards propagation (incl. error calculation & gradient descent)
-            wih, who = ANN.backward_prop(inputs, hidden_outputs, final_outputs,
-                                         targets, wih, who)
+        # taking batch_size records at a time
+        for start in range(first_record if epoch == first_epoch else 0,
+                           len(labels), batch_size):
+            wih, who = training_step(images[start:start + batch_size],
+                                     labels[start:start + batch_size], wih,
+                                     who)
+
+            # checkpoint every checkpoint_interval records
+            end = start + batch_size
+            if (run is not None and config.checkpoint_interval
+                    and next_checkpoint <= end < len(labels)):
+                save_training_checkpoint(run, wih, who, epoch, end, tic)
+                next_checkpoint = end + config.checkpoint_interval
+
+        # report progress on the test set at the end of every epoch
+        if test_data is not None:
+            results = evaluation(test_data, wih, who)
+            metrics.log_phase("epoch_evaluation",
+                              results["seconds"],
+                              scenario=i,
+                              epoch=epoch + 1,
+                              accuracy=f"{results['accuracy']:0.4f}")
+
+        # checkpoint at the end of every epoch (but the last)
+        if run is not None and epoch + 1 < num_epochs:
+            save_training_checkpoint(run, wih, who, epoch + 1, 0, tic)
 
     ##### stop clock for training
     toc = time.perf_counter()
-    print(f"Training took {toc - tic:0.4f} seconds")
+    metrics.log_phase("training", toc - tic, scenario=i)
 
     # save weights to file
-    save_weights(wih, who, wih_file, who_file)
+    save_weights(wih, who, wih_file, who_file, i)
 
     return wih, who
 
 
-def load_test_data():
+# position in a single training run at which each scenario is complete,
+# as (epoch, number of records into that epoch), or None if the scenarios
+# are not all part of one run - i.e. unless each scenario either uses
+# a first part of epoch 1 or whole epochs of the full set of records
+def scenario_checkpoints():
+
+    num_lines = max(scenario["num_lines"] for scenario in config.scenarios)
+
+    scenario_ends = []
+    for scenario in config.scenarios:
+        if scenario["num_epochs"] != 1 and scenario["num_lines"] != num_lines:
+            return None
+        scenario_ends.append(
+            (scenario["num_epochs"], scenario["num_lines"]))
+
+    return scenario_ends
+
+
+# train all scenarios in one pass through the training data, saving (and
+# testing) the weights of each scenario when the run reaches the point
+# at which that scenario is complete - gives the same weights as calling
+# training() for each scenario from the same initial weights
+def training_all_scenarios(wih_init, who_init, test_data, run=None):
+    #
+    #  wih_init = initial weights used between input and hidden layers
+    #  who_init = initial weights used between hidden and output layers
+    #  test_data = test images and labels used to score each scenario
+    #  run = if given, the training run (see new_run) - checkpointed as it
+    #        goes along, and continued from the position it has reached
+    #
 
-    ##### start clock for reading test data
+    ##### start clock for training
     tic = time.perf_counter()
 
-    # load the MNIST test data CSV file into a list
-    test_data_file = open("mnist_test.csv", 'r')
-    test_data_list = test_data_file.readlines()
-    test_data_file.close()
+    scenario_ends = scenario_checkpoints()
+    # length of the single run covering all scenarios
+    num_lines = max(num_records for num_epochs, num_records in scenario_ends)
+    num_epochs = max(num_epochs for num_epochs, num_records in scenario_ends)
+
+    # load training data
+    images, labels = load_training_data(num_lines)
+
+    # a training dataset shorter than the scenarios ask for is used as far as
+    # it goes (as by training()), so every scenario is still saved and tested
+    num_lines = len(labels)
+    scenario_ends = [(num_epochs, min(num_records, num_lines))
+                     for num_epochs, num_records in scenario_ends]
+
+    # initialise weights (copies, so the initial weights are left unchanged)
+    wih = wih_init.copy()
+    who = who_init.copy()
+
+    batch_size = config.configuration["batch_size"]
+    test_scores = [None] * len(scenario_ends)
+
+    # continue from the position reached by a resumed run
+    # (scenarios already complete have been saved and tested)
+    first_epoch = 1
+    first_record = 0
+    if run is not None and run["wih"] is not None:
+        wih = run["wih"].copy()
+        who = run["who"].copy()
+        first_epoch = run["epochs_done"] + 1
+        first_record = run["records_done"]
+        test_scores = run["test_scores"]
+        tic -= run["seconds"]
+    if run is not None:
+        run["test_scores"] = test_scores
+
+    # save and test the weights for scenario i
+    def complete_scenario(i, wih, who):
+        toc = time.perf_counter()
+        metrics.log_phase("training_until_scenario", toc - tic, scenario=i)
+        save_weights(wih, who, "weights_wih_" + str(i) + ".csv",
+                     "weights_who_" + str(i) + ".csv", i)
+        test_scores[i] = testing(test_data, wih, who, i)
+
+    for epoch in range(first_epoch, num_epochs + 1):
+        next_checkpoint = config.checkpoint_interval
+        for start in range(first_record if epoch == first_epoch else 0,
+                           num_lines, batch_size):
+            end = min(start + batch_size, num_lines)
+
+            # a scenario ending part way through this batch would have trained
+            # on a shorter last batch, so finish it on a copy of the weights
+            for i, (scenario_epochs,
+                    scenario_lines) in enumerate(scenario_ends):
+                if scenario_epochs == epoch and start < scenario_lines < end:
+                    complete_scenario(
+                        i,
+                        *training_step(images[start:scenario_lines],
+                                       labels[start:scenario_lines],
+                                       wih.copy(), who.copy()))
+
+            wih, who = training_step(images[start:end], labels[start:end],
+                                     wih, who)
+
+            # scenarios ending exactly at the end of this batch
+            for i, (scenario_epochs,
+                    scenario_lines) in enumerate(scenario_ends):
+                if scenario_epochs == epoch and scenario_lines == end:
+                    complete_scenario(i, wih.copy(), who.copy())
+
+            # checkpoint every checkpoint_interval records
+            if (run is not None and config.checkpoint_interval
+                    and next_checkpoint <= end < num_lines):
+                save_training_checkpoint(run, wih, who, epoch - 1, end, tic)
+                next_checkpoint = end + config.checkpoint_interval
+
+        # report progress on the test set at the end of every epoch
+        results = evaluation(test_data, wih, who)
+        metrics.log_phase("epoch_evaluation",
+                          results["seconds"],
+                          epoch=epoch,
+                          accuracy=f"{results['accuracy']:0.4f}")
+
+        # checkpoint at the end of every epoch (but the last)
+        if run is not None and epoch < num_epochs:
+            save_training_checkpoint(run, wih, who, epoch, 0, tic)
 
-    ##### stop clock for reading test data
+    ##### stop clock for training
     toc = time.perf_counter()
-    print(f"Reading test data took {toc - tic:0.4f} seconds")
+    metrics.log_phase("training_all_scenarios", toc - tic)
 
-    return test_data_list
+    return test_scores
 
 
-# load and prepare test data,
-# then iterate through records performing forward propagation
-def testing(test_data_list, wih, who):
-    ##### start clock for testing
+def load_test_data():
+
+    ##### time reading test data
+    with metrics.span("read_test_data", log=True):
+        # load the MNIST test data (images and labels)
+        test_data = mnist_data.load_dataset("mnist_test.csv")
+
+    return test_data
+
+
+# number of test records propagated through the ANN at a time by evaluation
+# (bounds the memory used by the hidden layer outputs)
+evaluation_chunk_size = 10000
+
+
+# utility function to save per-digit metrics and confusion matrix for a scenario
+# (one row per actual digit, confusion columns are the predicted digits)
+def save_test_metrics(i, results):
+
+    rows = numpy.column_stack((numpy.arange(10), results["precision"],
+                               results["recall"], results["confusion"]))
+    header = "digit,precision,recall," + ",".join(
+        "predicted_" + str(digit) for digit in range(10))
+    savetxt("test_metrics_" + str(i) + ".csv",
+            rows,
+            delimiter=',',
+            fmt=["%d", "%.4f", "%.4f"] + ["%d"] * 10,
+            header=header,
+            comments="")
+
+
+# score the whole test set in batches of records (one forward propagation
+# per chunk rather than per record) and work out accuracy, confusion matrix
+# and per-digit precision and recall
+def evaluation(test_data, wih, who, chunk_size=evaluation_chunk_size):
+    ##### start clock for evaluation
     tic = time.perf_counter()
 
-    # count how many predictions are correct
-    count = 0
-
-    # go through all the records in the test data set
-    for record in test_data_list:
-        # split the record by the ',' commas
-        all_values = record.split(',')
-        # get label i.e. "correct" value
-        # according to person who labelled the test data
-        label = int(all_values[0])
-        # normalise (so in range 0 - 1) and
-        # shift the inputs (ANN works best if avoid 0)
-        inputs_list = (numpy.asfarray(all_values[1:]) / 255.0 * 0.99) + 0.01
-        # convert inputs list to 2d array
-        inputs = numpy.array(inputs_list, ndmin=2).T
+    images, labels = test_data
+    output_nodes = who.shape[0]
+
+    # confusion matrix: rows are the actual digits, columns the predictions
+    confusion = numpy.zeros((output_nodes, output_nodes), dtype=numpy.int64)
+
+    for start in range(0, len(labels), chunk_size):
+        # normalise and shift the inputs, one column per record
+        inputs = mnist_data.scale_inputs(images[start:start + chunk_size]).T
         # forward propagation
         temp, outputs = ANN.forward_prop(inputs, wih, who)
-        # get ANN's top prediction (by taking the index of the highest value)
-        top_prediction = numpy.argmax(outputs)
-        # append correct or incorrect to list
-        if (top_prediction == label):
-            # ANN's prediction matches MNIST label
-            count = count + 1
-
-    ##### stop clock for testing
+        # get ANN's top prediction for each record
+        # (by taking the index of the highest value in each column)
+        top_predictions = numpy.argmax(outputs, axis=0)
+        numpy.add.at(confusion, (labels[start:start + chunk_size],
+                                 top_predictions), 1)
+
+    # precision: fraction of predictions of a digit that were right
+    # recall: fraction of records of a digit that were predicted right
+    correct = numpy.diag(confusion)
+    predicted = confusion.sum(axis=0)
+    actual = confusion.sum(axis=1)
+    precision = numpy.divide(correct,
+                             predicted,
+                             out=numpy.zeros(output_nodes),
+                             where=predicted > 0)
+    recall = numpy.divide(correct,
+                          actual,
+                          out=numpy.zeros(output_nodes),
+                          where=actual > 0)
+
+    ##### stop clock for evaluation
     toc = time.perf_counter()
-    print(f"Testing took {toc - tic:0.4f} seconds")
 
-    # calculate the test score, the fraction of correct predictions
-    score = count / len(test_data_list)
-    test_score = str(round(score * 100, 2)) + "%"
+    results = {
+        "accuracy": correct.sum() / max(len(labels), 1),
+        "confusion": confusion,
+        "precision": precision,
+        "recall": recall,
+        "seconds": toc - tic
+    }
+
+    return results
+
+
+# load and prepare test data,
+# then evaluate the ANN on all records and report its accuracy
+def testing(test_data, wih, who, i=None):
+
+    results = evaluation(test_data, wih, who)
+    metrics.log_phase("testing",
+                      results["seconds"],
+                      scenario=i,
+                      accuracy=f"{results['accuracy']:0.4f}")
+
+    # per-digit precision and recall
+    for digit in range(len(results["precision"])):
+        print(f"  digit {digit}: precision {results['precision'][digit]:0.4f}"
+              f" recall {results['recall'][digit]:0.4f}")
+
+    if i is not None:
+        save_test_metrics(i, results)
+
+    # the test score is the fraction of correct predictions
+    test_score = str(round(results["accuracy"] * 100, 2)) + "%"
 
     return test_score
 
@@ -205,9 +541,9 @@ def testing(test_data_list, wih, who):
 # initialise ANN configuration, scenarios datablock and weights
 def initialise_for_train_and_test():
 
-    input_nodes = main.configuration["input_nodes"]
-    hidden_nodes = main.configuration["hidden_nodes"]
-    output_nodes = main.configuration["output_nodes"]
+    input_nodes = config.configuration["input_nodes"]
+    hidden_nodes = config.configuration["hidden_nodes"]
+    output_nodes = config.configuration["output_nodes"]
 
     # initialise weights
 
@@ -222,23 +558,62 @@ def initialise_for_train_and_test():
 # this if statement stops the code below being executed when this file is imported
 if __name__ == "__main__":
 
-    # initialisation
-    wih_init, who_init = initialise_for_train_and_test()
-
-    test_scores = []
+    parser = argparse.ArgumentParser(
+        description="Train and test the ANN for every scenario")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="continue the last run from its checkpoint")
+    args = parser.parse_args()
+
+    # scenarios are all part of one run if they can be trained in a single pass
+    single_pass = scenario_checkpoints() is not None
+
+    run = load_training_checkpoint() if args.resume else None
+    if run is None:
+        if args.resume:
+            print("No checkpoint to resume from, so starting a new run")
+        # initialisation
+        wih_init, who_init = initialise_for_train_and_test()
+        run = new_run(wih_init, who_init, None if single_pass else 0)
+    elif (run["scenario"] is None) != single_pass:
+        raise SystemExit(checkpoint_file + " is for a different kind of run")
+    else:
+        # same initial weights as the interrupted run
+        wih_init, who_init = run["wih_init"], run["who_init"]
+        print("Resuming from " + checkpoint_file + " (" +
+              str(run["epochs_done"]) + " epochs and " +
+              str(run["records_done"]) + " records done)")
 
     # load test data (same for all scenarios, so only do once)
-    test_data_list = load_test_data()
+    test_data = load_test_data()
+
+    if single_pass:
+        # scenarios are all part of one run, so train them in a single pass
+        test_scores = training_all_scenarios(wih_init, who_init, test_data,
+                                             run)
+    else:
+        test_scores = run["test_scores"]
+
+        # loop through each of the scenarios
+        # (from the one reached, if resumed):
+        for i in range(run["scenario"], len(config.scenarios)):
+
+            # train the neural network
+            wih, who = training(i, wih_init, who_init, test_data, run)
 
-    # loop through each of 4 scenarios:
-    for i in range(0, 4):
+            # test the neural network
+            test_score = testing(test_data, wih, who, i)
 
-        # train the neural network
-        wih, who = training(i, wih_init, who_init)
+            test_scores.append(test_score)
 
-        # test the neural network
-        test_score = testing(test_data_list, wih, who)
+            # next scenario starts from the initial weights
+            run.update(new_run(wih_init, who_init, i + 1),
+                       test_scores=test_scores)
+            if i + 1 < len(config.scenarios):
+                save_training_checkpoint(run, wih_init, who_init, 0, 0,
+                                         time.perf_counter())
 
-        test_scores.append(test_score)
+    save_test_scores(test_scores)
 
-    save_test_scores(test_scores)
\ No newline at end of file
+    # run is complete, so its checkpoint is no longer needed
+    checkpoints.remove_checkpoint(checkpoint_file)
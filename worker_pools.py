@@ -0,0 +1,47 @@
+###################################################################################
+#
+#   Pools of worker processes using one core each
+#
+#   numpy's maths library starts a thread per core in every process, so a pool
+#   of N workers on N cores would otherwise run N x N threads competing for the
+#   same cores. Workers started inside single_threaded_workers are limited to
+#   one thread each
+#
+#   called from:
+#         parallel_training.py
+#         sweep.py
+#         batch_score.py
+#
+###################################################################################
+
+# contextlib for setting up pools of single-threaded workers
+import contextlib
+# multiprocessing for the context the pools are started from
+import multiprocessing
+# os for limiting the threads used by each worker
+import os
+
+# environment variables limiting the threads used by numpy's maths library,
+# so each worker uses one core rather than all workers competing for all cores
+thread_variables = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                    "MKL_NUM_THREADS")
+
+
+# multiprocessing context for pools of worker processes using one core each:
+# workers are started fresh ("spawn"), so they pick up the limit on threads
+# set here when they first load numpy - the limit is lifted again on leaving
+# the with statement, so pools must be started inside it
+@contextlib.contextmanager
+def single_threaded_workers():
+
+    saved_variables = {name: os.environ.get(name) for name in thread_variables}
+    try:
+        for name in thread_variables:
+            os.environ[name] = "1"
+        yield multiprocessing.get_context("spawn")
+    finally:
+        for name, value in saved_variables.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value